@@ -0,0 +1,129 @@
+from main3 import *
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import itertools
+import logging
+
+ITEM_FIELDS = {     # map {field: (type, default value, minimal value)}
+    'count': (int, DEFAULT_COUNT, 1),
+    'min_price': (float, DEFAULT_MIN_PRICE, 0),
+    'max_price': (float, DEFAULT_MAX_PRICE, 0),
+    'min_rating': (float, DEFAULT_RATING, 0),
+    'nrates': (int, DEFAULT_MIN_NRATES, 0),
+}
+BATCH_IDS = itertools.count(1)
+
+
+class BatchOptimizer:
+    """
+    Optimizes many baskets in one call.
+    Queries shared by baskets are scrapped once: every unique query is loaded by one task and the algorithm
+    is run for every basket as soon as all its products are loaded. Results are yielded in order of completion,
+    so total time depends on the number of unique queries, not on the number of baskets.
+    """
+
+    def __init__(self, workers=SEARCH_WORKERS, find_workers=BATCH_FIND_WORKERS, max_time=BATCH_QUERY_MAX_TIME,
+                 budget=None, coordinator=None):
+        """
+        :param workers:         (int)           : number of queries scrapped at the same time
+        :param find_workers:    (int)           : number of baskets optimized at the same time
+        :param max_time:        (float)         : deadline of scraping one query in seconds
+        :param budget:          (RequestBudget) : limit of http requests shared by all the queries
+        :param coordinator:     (ScrapeCoordinator) : queries are scrapped by worker processes (see workers.py)
+        """
+        self.workers = workers
+        self.find_workers = find_workers
+        self.max_time = max_time
+        self.budget = budget
+        self.tenant = f'batch-{next(BATCH_IDS)}'     # all queries of the batch share one share of the site
+        self.loader = SkapiecOptimizer(coordinator)     # scraps queries and keeps offers cache between batches
+
+    @staticmethod
+    def parse_baskets(data):
+        """
+        Validates baskets passed to the batch. Basket is a list of items or a dict {'id': ..., 'items': [...]},
+        item is a dict with 'name' and optional UserRequirements fields.
+        :param data:    (dict)  : {'baskets': [basket1, basket2, ...]}
+        :return:        (list)  : list of tuples (basket id, list of UserRequirements)
+        """
+        if not isinstance(data, dict) or not isinstance(data.get('baskets'), list):
+            raise InvalidBasketException('expected object with "baskets" list')
+
+        baskets = []
+        for idx, basket in enumerate(data['baskets']):
+            basket_id, items = idx, basket
+            if isinstance(basket, dict):
+                basket_id, items = basket.get('id', idx), basket.get('items')
+            if not isinstance(items, list) or not 0 < len(items) <= MAX_BASKET_PRODUCTS:
+                raise InvalidBasketException(f'basket {basket_id}: expected 1-{MAX_BASKET_PRODUCTS} items')
+            baskets.append((basket_id, [BatchOptimizer.parse_item(basket_id, pid, item)
+                                        for pid, item in enumerate(items, 1)]))
+        return baskets
+
+    @staticmethod
+    def parse_item(basket_id, pid, item):
+        if not isinstance(item, dict) or not isinstance(item.get('name'), str) or not item['name'].strip():
+            raise InvalidBasketException(f'basket {basket_id}: item {pid} has no name')
+        values = {}
+        for field, (field_type, default, min_value) in ITEM_FIELDS.items():
+            try:
+                values[field] = field_type(item.get(field, default))
+            except (TypeError, ValueError):
+                raise InvalidBasketException(f'basket {basket_id}: item {pid} has invalid {field}')
+            if values[field] < min_value:
+                raise InvalidBasketException(f'basket {basket_id}: item {pid} has invalid {field}')
+        return UserRequirements(pid, item['name'], **values)
+
+    def run(self, baskets):
+        """
+        Optimizes baskets, yields results of every basket as soon as it is ready.
+        :param baskets: (list)  : list of tuples (basket id, list of UserRequirements), see parse_baskets
+        :return:        (generator) : dicts {'id', 'results', 'msgs', 'partial', 'gap'},
+                                      {'id', 'error'} if optimization of the basket has failed
+        """
+        if any(len(items) <= LARGE_BASKET_THRESHOLD for _, items in baskets):
+            max_offers, max_stores = MAX_OFFERS, MAX_STORES
+        else:
+            max_offers, max_stores = LARGE_BASKET_MAX_OFFERS, LARGE_BASKET_MAX_STORES
+        queries = {normalize_query(user_req.name) for _, items in baskets for user_req in items}
+        logging.info(f'[BATCH] {len(baskets)} basket(s), {len(queries)} unique product(s)')
+
+        load_executor = ThreadPoolExecutor(max_workers=self.workers)
+        find_executor = ThreadPoolExecutor(max_workers=self.find_workers)
+        try:
+            query_futures = {query: load_executor.submit(self.load_query, query, max_offers, max_stores)
+                             for query in sorted(queries)}
+            basket_futures = {find_executor.submit(self.optimize, basket_id, items, query_futures): basket_id
+                              for basket_id, items in baskets}
+            for future in as_completed(basket_futures):
+                try:
+                    result = future.result()
+                except Exception as e:      # one broken basket does not stop the others
+                    logging.exception(f'[BATCH] basket {basket_futures[future]} failed')
+                    result = {'id': basket_futures[future], 'error': f'{type(e).__name__}: {e}'}
+                yield result
+        finally:
+            find_executor.shutdown(wait=False, cancel_futures=True)
+            load_executor.shutdown(wait=False, cancel_futures=True)
+
+    def load_query(self, query, max_offers, max_stores):
+        cached = self.loader.get_cached(query, max_offers, max_stores)
+        if cached:
+            return cached
+        ctx = SearchContext(self.max_time, find_time=0, budget=self.budget, tenant=self.tenant,
+                            weight=BACKGROUND_WEIGHT)
+        plist = self.loader.search_product(query, max_offers, max_stores, ctx)
+        if plist.complete:
+            self.loader.offers_cache.put(query, plist)
+        return plist
+
+    def optimize(self, basket_id, user_reqs, query_futures):
+        partial = False
+        for user_req in user_reqs:
+            plist = query_futures[normalize_query(user_req.name)].result()
+            partial = partial or not (plist.complete or plist.not_found)
+            user_req.found_products = plist.copy_for(user_req)
+
+        algorithm_handler = AlgorithmHandler(user_reqs)
+        results = algorithm_handler.find()
+        return {'id': basket_id, 'results': [result_set.to_dict() for result_set in results],
+                'msgs': algorithm_handler.msgs, 'partial': partial, 'gap': algorithm_handler.gap}
@@ -0,0 +1,122 @@
+"""
+Offline batch mode - optimizes baskets read from JSONL file (or stdin) without Flask server.
+Every input line is a basket: list of items or {"id": ..., "items": [...]}, item is a dict with "name"
+and optional "count", "min_price", "max_price", "min_rating", "nrates".
+Results are written as JSON lines (one per basket) as soon as basket is optimized.
+
+Usage:
+python batch_cli.py baskets.jsonl -o results.jsonl --workers 8 --max-requests 5000
+python batch_cli.py baskets.jsonl -o results.jsonl --resume      # skip baskets already in results.jsonl
+cat baskets.jsonl | python batch_cli.py - > results.jsonl
+python batch_cli.py baskets.jsonl -o results.jsonl --queue 0.0.0.0:50505      # scrap with workers.py processes
+"""
+from batch import BatchOptimizer
+from budget import RequestBudget
+from exceptions import InvalidBasketException, WorkerAuthKeyException
+from settings import *
+import argparse
+import json
+import logging
+import os
+import sys
+
+
+def read_baskets(lines):
+    """
+    Parses JSONL baskets, basket without id gets number of its line.
+    :param lines:   (iterable)  : lines of the input
+    :return:        (list)      : list of tuples (basket id, list of UserRequirements)
+    """
+    baskets = []
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            basket = json.loads(line)
+        except ValueError as e:
+            raise InvalidBasketException(f'line {lineno}: invalid JSON: {e}')
+        if isinstance(basket, list):
+            basket = {'id': lineno, 'items': basket}
+        elif isinstance(basket, dict):
+            basket.setdefault('id', lineno)
+        baskets.extend(BatchOptimizer.parse_baskets({'baskets': [basket]}))
+    return baskets
+
+
+def read_done_ids(path):
+    """
+    Returns ids of baskets that are already in the output file (used to resume interrupted job).
+    Ids are compared as JSON strings, last line might be broken if the job was killed while writing.
+    Failed baskets (lines with "error") are optimized again.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+                if 'error' not in result:
+                    done.add(json.dumps(result['id']))
+            except (ValueError, KeyError, TypeError):
+                continue
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Optimize baskets from JSONL file.')
+    parser.add_argument('input', help='JSONL file with baskets, "-" means stdin')
+    parser.add_argument('-o', '--output', default='-', help='JSONL file with results, "-" means stdout')
+    parser.add_argument('-w', '--workers', type=int, default=SEARCH_WORKERS,
+                        help='number of products scrapped at the same time')
+    parser.add_argument('--find-workers', type=int, default=BATCH_FIND_WORKERS,
+                        help='number of baskets optimized at the same time')
+    parser.add_argument('--max-requests', type=int, default=None, help='limit of http requests of the whole job')
+    parser.add_argument('--resume', action='store_true', help='skip baskets that are already in the output file')
+    parser.add_argument('--queue', default=None, help='host:port of work queue served for workers.py processes')
+    args = parser.parse_args(argv)
+
+    if args.resume and args.output == '-':
+        parser.error('--resume requires --output file')
+
+    try:
+        if args.input == '-':
+            baskets = read_baskets(sys.stdin)
+        else:
+            with open(args.input, encoding='utf-8') as f:
+                baskets = read_baskets(f)
+    except InvalidBasketException as e:
+        logging.error(f'[BATCH_CLI] {e}')
+        return 2
+
+    if args.resume:
+        done_ids = read_done_ids(args.output)
+        baskets = [(basket_id, items) for basket_id, items in baskets if json.dumps(basket_id) not in done_ids]
+        logging.info(f'[BATCH_CLI] resuming, {len(done_ids)} basket(s) already done')
+
+    budget = RequestBudget(args.max_requests)
+    coordinator = None
+    if args.queue:
+        from workers import ScrapeCoordinator, parse_address
+        try:
+            coordinator = ScrapeCoordinator(parse_address(args.queue))
+        except WorkerAuthKeyException as e:
+            logging.error(f'[BATCH_CLI] {e}')
+            return 2
+    optimizer = BatchOptimizer(args.workers, args.find_workers, budget=budget, coordinator=coordinator)
+    out = sys.stdout if args.output == '-' else open(args.output, 'a' if args.resume else 'w', encoding='utf-8')
+    try:
+        for done, result in enumerate(optimizer.run(baskets), 1):
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()     # every finished basket is saved, so the job can be resumed
+            logging.info(f'[BATCH_CLI] {done}/{len(baskets)} basket(s) done, {budget.used} request(s) sent')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if coordinator:
+            coordinator.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
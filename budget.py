@@ -0,0 +1,155 @@
+from settings import *
+import math
+import statistics
+import threading
+
+
+class RequestBudget:
+    """
+    Thread-safe limit of http requests. One budget can be shared by many searches (e.g. whole batch job).
+    """
+
+    def __init__(self, limit):
+        """
+        :param limit:   (int)   : max number of requests, None means no limit
+        """
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one request from the budget.
+        :return:    (boolean)   : False if budget is exhausted and request must not be sent
+        """
+        with self.lock:
+            if self.limit is not None and self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    def exhausted(self):
+        return self.limit is not None and self.used >= self.limit
+
+    def remaining(self):
+        return None if self.limit is None else max(0, self.limit - self.used)
+
+
+class BudgetPlanner(RequestBudget):
+    """
+    Request budget of one search handed out between basket items, their offers pages and store rows.
+    Every item gets its search page first. Number of offers pages of the item is planned as soon as its
+    search page is loaded: requests that are not reserved by other items are shared by this item and items
+    still waiting for their search pages in proportion to the typical price of the item (savings on
+    expensive items are bigger). Offers pages that were not planned are scrapped when the item has finished
+    and requests are still left.
+    Store rows that can not change the answer are skipped: once the item has an offer that meets
+    requirements, a row is scrapped only if it meets them too and its price is lower than the best total
+    of the item plus the biggest delivery cost seen (the most that a delivery shared with other item can save).
+    """
+
+    def __init__(self, limit, row_requests=PLANNER_ROW_REQUESTS):
+        """
+        :param limit:           (int)   : max number of requests of the search
+        :param row_requests:    (float) : expected number of requests of one store row (delivery pages)
+        """
+        super().__init__(limit)
+        self.row_requests = row_requests
+        self.items = {}         # map {normalized query: list of UserRequirements}
+        self.weights = {}       # map {normalized query: typical price of the item}
+        self.loaded = set()     # items whose search page has been loaded, others wait for it
+        self.reserved = {}      # map {normalized query: requests reserved for offers pages of the item}
+        self.planned = {}       # map {normalized query: number of planned offers pages}
+        self.best = {}          # map {normalized query: best total price of offers meeting requirements}
+        self.max_delivery = 0
+        self.skipped_rows = {}  # map {normalized query: number of skipped store rows}
+
+    def add_item(self, query, user_reqs):
+        """ Registers item before scraping starts, so that its search page is reserved """
+        with self.lock:
+            self.items[query] = list(user_reqs)
+            self.best[query] = math.inf
+
+    def page_cost(self, max_stores):
+        return 1 + max_stores * self.row_requests
+
+    def free(self):
+        """ Requests that are neither reserved nor needed by search pages of waiting items """
+        return self.remaining() - sum(self.reserved.values()) - len(self.items.keys() - self.loaded)
+
+    def plan_offers(self, query, overviews, max_offers, max_stores):
+        """
+        :param overviews:   (list)  : products overview that can be scrapped, the most relevant first
+        :return:            (int)   : number of offers pages to scrap, at least one
+        """
+        with self.lock:
+            prices = [overview['min_price'] for overview in overviews]
+            self.weights[query] = max(statistics.median(prices), 1) if prices else 1
+            self.loaded.add(query)
+            waiting = len(self.items.keys() - self.loaded)
+            mean_weight = sum(self.weights.values()) / len(self.weights)
+            share = self.free() * self.weights[query] / (self.weights[query] + waiting * mean_weight)
+            count = max(1, min(max_offers, len(overviews), int(share // self.page_cost(max_stores))))
+            self.reserved[query] = count * self.page_cost(max_stores)
+            self.planned[query] = count
+            return count
+
+    def more_offers(self, query, max_stores):
+        """
+        Reserves requests of one more offers page of the item if they are free.
+        :return:    (boolean)   : True if the page can be scrapped
+        """
+        with self.lock:
+            self.reserved.pop(query, None)      # item has finished planned pages
+            if self.free() < self.page_cost(max_stores):
+                return False
+            self.reserved[query] = self.page_cost(max_stores)
+            self.planned[query] = self.planned.get(query, 0) + 1
+            return True
+
+    def finish(self, query):
+        """ Releases requests reserved for the item, it is called also when the item has not been found """
+        with self.lock:
+            self.loaded.add(query)
+            self.reserved.pop(query, None)
+
+    def accepts(self, query, price, rating, rating_count):
+        return any(user_req.accepts(price, rating, rating_count) for user_req in self.items.get(query, ()))
+
+    def allow_row(self, query, row):
+        """
+        :param row:     (StoreRow)  : offer extracted from offers page
+        :return:        (boolean)   : False if the row can not improve the result
+        """
+        with self.lock:
+            if row.free_delivery or self.best.get(query, math.inf) == math.inf:
+                return True     # free delivery costs no requests
+            if (self.accepts(query, row.price, row.rating_avg, row.rating_count)
+                    and row.price < self.best[query] + self.max_delivery):
+                return True
+            self.skipped_rows[query] = self.skipped_rows.get(query, 0) + 1
+            return False
+
+    def allow_page(self, query, min_price):
+        """
+        :param min_price:   (float)     : the lowest price on offers page (from products overview)
+        :return:            (boolean)   : False if no offer of the page can improve the result
+        """
+        with self.lock:
+            return min_price < self.best.get(query, math.inf) + self.max_delivery
+
+    def add_products(self, query, products):
+        """ Updates best total price of the item with scrapped offers """
+        with self.lock:
+            for p in products:
+                self.max_delivery = max(self.max_delivery, p.min_delivery)
+                if query in self.best and self.accepts(query, p.price, p.rating, p.rating_count):
+                    self.best[query] = min(self.best[query], p.total_min_price)
+
+    def pruned(self, query):
+        """ True if rows of the item were skipped, its offers depend on requirements of this search """
+        return self.skipped_rows.get(query, 0) > 0
+
+    def stats(self):
+        return {'limit': self.limit, 'used': self.used, 'planned_pages': dict(self.planned),
+                'skipped_rows': dict(self.skipped_rows)}
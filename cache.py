@@ -0,0 +1,165 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from collections import OrderedDict
+from settings import *
+import threading
+import time
+
+
+def normalize_query(name):
+    """
+    Normalizes product name, so different spelling of the same query gives the same key.
+    :param name:    (str)   : product name entered by the user
+    :return:        (str)   : lower case name with single spaces
+    """
+    return ' '.join(name.lower().split())
+
+
+def normalize_url(url):
+    """
+    Normalizes url, so the same page requested with differently written url gives the same key.
+    :param url:     (str)   :
+    :return:        (str)   : url with lower case scheme and host, sorted query and no trailing slash
+    """
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ''))
+
+
+class TTLCache:
+    """
+    Thread-safe map in which every entry expires after ttl seconds. If max_size is given, the least recently
+    used entries are evicted when the map is full. Expired entries are swept by put every CACHE_SWEEP_INTERVAL
+    seconds, so keys that are never read again do not stay in memory.
+    """
+
+    def __init__(self, ttl, max_size=None):
+        """
+        :param ttl:         (float) : time to live of an entry in seconds
+        :param max_size:    (int)   : max number of entries, None means no limit
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()    # map {key: (expiration time, value)}, the least recently used first
+        self.uses = {}          # map {key: number of puts and hits}, popular entries are kept in snapshots
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0      # entries removed because the map was full
+        self.last_sweep = time.time()
+
+    def get(self, key):
+        """
+        Returns cached value or None if key is not cached or its entry has expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self.entries.pop(key, None)
+                self.uses.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.uses[key] += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.insert(key, time.time() + self.ttl, value)
+            self.uses[key] = self.uses.get(key, 0) + 1
+
+    def insert(self, key, expires, value):
+        """ Adds entry as the most recently used one, it must be called with the lock held """
+        now = time.time()
+        if now - self.last_sweep >= CACHE_SWEEP_INTERVAL:
+            self.sweep(now)
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while self.max_size is not None and len(self.entries) > self.max_size:
+            old_key, _ = self.entries.popitem(last=False)
+            self.uses.pop(old_key, None)
+            self.evictions += 1
+
+    def sweep(self, now):
+        """ Removes expired entries, it must be called with the lock held """
+        for key in [key for key, (expires, _) in self.entries.items() if expires < now]:
+            del self.entries[key]
+            self.uses.pop(key, None)
+        self.last_sweep = now
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.uses.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.uses = {}
+
+    def snapshot(self, limit=None):
+        """
+        Returns fresh entries, the most used first.
+        :param limit:   (int)   : max number of entries, None means all
+        :return:        (list)  : list of tuples (key, expiration time, value)
+        """
+        now = time.time()
+        with self.lock:
+            entries = [(key, expires, value) for key, (expires, value) in self.entries.items() if expires >= now]
+            entries.sort(key=lambda entry: self.uses.get(entry[0], 0), reverse=True)
+        return entries[:limit]
+
+    def restore(self, key, expires, value):
+        """
+        Adds entry from snapshot unless it has expired or a fresh entry of the key has been cached in the meantime.
+        :return:    (boolean)   : True if entry has been added
+        """
+        now = time.time()
+        with self.lock:
+            if expires < now or (key in self.entries and self.entries[key][0] >= now):
+                return False
+            self.insert(key, min(expires, now + self.ttl), value)
+            self.uses[key] = 0
+            return True
+
+    def stats(self):
+        return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class NegativeCache(TTLCache):
+    """
+    Cache of negative results: query without results, offer without delivery information, detail page without
+    offers. Value of an entry is the number of requests the result cost, every hit counts them as avoided.
+    """
+
+    def __init__(self, ttl, max_size=None):
+        super().__init__(ttl, max_size)
+        self.avoided = {}       # map {kind: number of avoided requests}
+
+    def add(self, kind, key, requests=1):
+        """
+        :param kind:        (str)   : type of the result ('query', 'delivery', 'offers')
+        :param key:         (str)   : normalized query or url
+        :param requests:    (int)   : number of requests that will be avoided by next checks
+        """
+        if self.ttl > 0:
+            self.put((kind, key), requests)
+
+    def check(self, kind, key):
+        """
+        :return:    (boolean)   : True if the result is known to be negative and requests must not be sent
+        """
+        requests = self.get((kind, key))
+        if requests is None:
+            return False
+        with self.lock:
+            self.avoided[kind] = self.avoided.get(kind, 0) + requests
+        return True
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats['avoided_requests'] = dict(self.avoided)
+        return stats
@@ -0,0 +1,82 @@
+from settings import *
+from budget import BudgetPlanner
+import itertools
+import logging
+import threading
+import time
+
+_tenant_ids = itertools.count(1)
+
+
+class SearchContext:
+    """
+    State shared by all the threads that work on one search.
+    Search has a deadline (MAX_TIME), part of it (FIND_TIME_RESERVE) is reserved for the algorithm,
+    so scraping has to be finished earlier. Search can be also cancelled, cancelled context behaves
+    like the one with exceeded deadline.
+    Number of http requests sent by the search can be limited by RequestBudget, BudgetPlanner also
+    decides which pages and store rows are worth the requests.
+    If any work was abandoned because of the deadline or budget, context is marked as partial.
+    Requests of the search are queued by FairScheduler under its tenant, searches of one session
+    or one batch job can share the tenant, so together they get one share of the site.
+    """
+
+    def __init__(self, max_time=MAX_TIME, find_time=FIND_TIME_RESERVE, budget=None, tenant=None, weight=1):
+        """
+        :param max_time:    (float)         : time of the whole search in seconds, None means no deadline
+        :param find_time:   (float)         : part of max_time reserved for the algorithm
+        :param budget:      (RequestBudget) : limit of http requests, None means no limit
+        :param tenant:      (str)           : owner of the search in the scheduler, None means the search alone
+        :param weight:      (float)         : share of the tenant in the scheduler
+        """
+        self.start_time = time.time()
+        self.end_time = self.start_time + max_time if max_time is not None else None
+        self.scrap_end_time = self.end_time - find_time if max_time is not None else None
+        self.cancelled = threading.Event()
+        self.budget = budget
+        self.planner = budget if isinstance(budget, BudgetPlanner) else None
+        self.tenant = tenant or f'search-{next(_tenant_ids)}'
+        self.weight = weight
+        self.partial = False
+
+    def remaining(self):
+        """
+        Returns time left for scraping, None if there is no deadline.
+        :return:    (float)
+        """
+        if self.cancelled.is_set():
+            return 0
+        if self.scrap_end_time is None:
+            return None
+        return max(0, self.scrap_end_time - time.time())
+
+    def find_remaining(self):
+        """
+        Returns time left for the whole search (scraping and algorithm), None if there is no deadline.
+        :return:    (float)
+        """
+        if self.end_time is None:
+            return None
+        return max(0, self.end_time - time.time())
+
+    def expired(self):
+        return self.remaining() == 0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def timeout(self, default=REQUEST_TIMEOUT):
+        """
+        Returns timeout for one http request, it never exceeds time left for scraping.
+        :param default: (float) : timeout used when there is enough time
+        :return:        (float)
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return min(default, remaining)
+
+    def mark_partial(self, reason):
+        if not self.partial:
+            logging.warning(f'[SearchContext] results will be partial: {reason}')
+        self.partial = True
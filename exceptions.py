@@ -27,4 +27,25 @@ class NoProductsOverview(Error):
 
 
 class UniqueIdException(Error):
-    pass
\ No newline at end of file
+    pass
+
+
+class InvalidBasketException(Error):
+    """
+    Raised when basket passed to batch optimization has invalid format
+    """
+    pass
+
+
+class ScrapingTaskException(Error):
+    """
+    Raised when scraping task sent to a worker process has failed
+    """
+    pass
+
+
+class WorkerAuthKeyException(Error):
+    """
+    Raised when work queue is served on or connected to a non-loopback address without SKAPIEC_WORKER_AUTHKEY
+    """
+    pass
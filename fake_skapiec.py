@@ -0,0 +1,218 @@
+"""
+Local fake of skapiec.pl used for load tests. It generates search, offers and delivery pages with the html
+structure the scraper expects, built from the same class names and ids (see settings.py). Pages are generated
+from the query (or product/offer id) and the seed, so the same url always returns the same page.
+
+Usage:
+python fake_skapiec.py --port 8001 --results 10 --offers 15 --stores 40 --latency pareto --latency-scale 0.05
+SKAPIEC_URL=http://127.0.0.1:8001 python routes2.py
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote_plus
+from settings import *
+import argparse
+import logging
+import random
+import re
+import threading
+import time
+import zlib
+
+SEARCH_PATH = re.compile(r'^/szukaj/w_calym_serwisie/([^/]+)/price/?$')
+OFFERS_PATH = re.compile(r'^/site/cat/(\d+)/comp/(\d+)/?$')
+DELIVERY_PATH = '/dostawa'
+LATENCIES = ('none', 'constant', 'exponential', 'pareto')
+
+
+class SiteConfig:
+    """ Parameters of the generated site """
+
+    def __init__(self, results=10, offers=15, stores=40, free_delivery=0.3, no_delivery=0.1, not_found=0.05,
+                 latency='none', latency_scale=0.05, padding=0, seed=0, concurrency=None):
+        """
+        :param results:         (int)   : number of products on the search page
+        :param offers:          (int)   : number of offers on the offers page of one product
+        :param stores:          (int)   : number of stores, the smaller the more stores are shared by products
+        :param free_delivery:   (float) : fraction of offers with free delivery
+        :param no_delivery:     (float) : fraction of offers without delivery information
+        :param not_found:       (float) : fraction of queries without results
+        :param latency:         (str)   : distribution of response time, one of LATENCIES
+        :param latency_scale:   (float) : mean (constant, exponential) or minimum (pareto) of response time in seconds
+        :param padding:         (int)   : bytes of filler markup added to every page (real pages are big)
+        :param seed:            (int)   :
+        :param concurrency:     (int)   : max number of requests served at the same time, None means no limit
+        """
+        self.results = results
+        self.offers = offers
+        self.stores = stores
+        self.free_delivery = free_delivery
+        self.no_delivery = no_delivery
+        self.not_found = not_found
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.padding = padding
+        self.seed = seed
+        self.concurrency = threading.BoundedSemaphore(concurrency) if concurrency else None
+
+    def rng(self, key):
+        return random.Random(zlib.crc32(f'{self.seed}:{key}'.encode()))
+
+    def delay(self):
+        if self.latency == 'constant':
+            return self.latency_scale
+        if self.latency == 'exponential':
+            return random.expovariate(1 / self.latency_scale)
+        if self.latency == 'pareto':
+            return min(self.latency_scale * random.paretovariate(1.5), 30)
+        return 0
+
+
+FILLER = '<div class="filler"><span>lorem ipsum</span></div>'
+
+
+def page(body, config):
+    filler = FILLER * (config.padding // len(FILLER))       # many small elements, like menus of real pages
+    return f'<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>{body}{filler}</body></html>'
+
+
+def price_str(price):
+    return f'{price:,.2f}'.replace(',', ' ').replace('.', ',') + ' zł'
+
+
+def search_page(query, config):
+    rng = config.rng(f'search:{query}')
+    if rng.random() < config.not_found:
+        return page(f'<div class="{NO_RESULTS_CLASS}"><div class="content">{NO_RESULTS_STR}</div></div>', config)
+
+    products = sorted((base_price(product_id, config), k, product_id)
+                      for k, product_id in ((k, zlib.crc32(f'{query}:{k}'.encode())) for k in range(config.results)))
+    boxes = []
+    for price, k, product_id in products:       # /price/ sorts results by the lowest offer
+        boxes.append(f'<div class="{PRODUCT_CLASS}"><a href="/site/cat/{k}/comp/{product_id}">'
+                     f'<h2 class="{PRODUCT_NAME_CLASS}">{query} {k}</h2></a>'
+                     f'<strong class="{PRODUCT_PRICE_CLASS}">od {price_str(price)}</strong></div>')
+    return page(f'<div class="{PRODUCTS_WRAPPER_CLASS}">' + ''.join(boxes) + '</div>', config)
+
+
+def base_price(product_id, config):
+    """ The lowest offer of the product, search page shows it as "od ... zł" """
+    return round(config.rng(f'price:{product_id}').uniform(10, 1000), 2)
+
+
+def offers_page(product_id, config):
+    rng = config.rng(f'offers:{product_id}')
+    lowest = base_price(product_id, config)
+    rows = []
+    for k in range(config.offers):
+        store_id = rng.randrange(config.stores) + 1
+        price = lowest if k == 0 else round(lowest * rng.uniform(1, 1.5), 2)
+        rating = {'avg': round(rng.uniform(1, 5), 1), 'count': rng.randrange(500)}
+        if rng.random() < config.free_delivery:
+            delivery = f'<span class="{FREE_DELIVERY_CLASS}">Darmowa dostawa</span>'
+        else:
+            delivery = (f'<div><a class="{DELIVERY_LINK_CLASS}" '
+                        f'href="{DELIVERY_PATH}?offer={product_id}-{k}">koszty dostawy</a></div>')
+        rows.append(f'<a class="{PRODUCT_CLASS_D}" href="/red/{store_id}/{product_id}{k}">'
+                    f'<span class="{OFFER_NAME_CLASS}">Produkt {product_id} w sklepie {store_id}</span>'
+                    f'<img class="{OFFER_STORE_CLASS}" alt="Sklep {store_id}">'
+                    f'<div class="{OFFER_RATING_CLASS}" data-description="{rating}"></div>'
+                    f'{delivery}<span class="{OFFER_PRICE_CLASS}">{price_str(price)}</span></a>')
+    return page(f'<div class="{PRODUCT_WRAPPER_CLASS_D}">' + ''.join(rows) + '</div>', config)
+
+
+def delivery_page(offer, method, config):
+    rng = config.rng(f'delivery:{offer}')
+    if rng.random() < config.no_delivery:
+        return page('<div class="message">Brak informacji o dostawie</div>', config)
+    prices = [round(rng.uniform(5, 25) + method, 2) for _ in range(rng.randrange(1, 4))]
+    rows = ''.join(f'<tr><td>Przesyłka {k}</td><td><b>{p:.2f} zł</b></td></tr>' for k, p in enumerate(prices))
+    return page(f'<div id="{DELIVERY_CONTENT_ID}"><table id="{DELIVERY_TABLE_ID}">{rows}</table></div>', config)
+
+
+class FakeSkapiecHandler(BaseHTTPRequestHandler):
+    config = SiteConfig()
+    requests = {'search': 0, 'offers': 0, 'delivery': 0, 'other': 0}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        search, offers = SEARCH_PATH.match(url.path), OFFERS_PATH.match(url.path)
+        if search:
+            kind, body = 'search', search_page(unquote_plus(search.group(1)).lower(), self.config)
+        elif offers:
+            kind, body = 'offers', offers_page(offers.group(2), self.config)
+        elif url.path == DELIVERY_PATH:
+            query = parse_qs(url.query)
+            kind = 'delivery'
+            body = delivery_page(query.get('offer', [''])[0], int(query.get('t', ['1'])[0]), self.config)
+        else:
+            kind, body = 'other', None
+        with self.lock:
+            self.requests[kind] += 1
+
+        if self.config.concurrency:     # capacity of the real site, requests over it wait
+            with self.config.concurrency:
+                time.sleep(self.config.delay())
+        else:
+            time.sleep(self.config.delay())
+        if body is None:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):     # client has read enough (see DeliveryRulesetsParser)
+            pass
+
+    def log_message(self, *_):
+        pass
+
+
+def serve(config, host='127.0.0.1', port=0):
+    """
+    Starts fake site in a background thread.
+    :return:    (ThreadingHTTPServer)   : server, its url is http://host:server.server_port
+    """
+    FakeSkapiecHandler.config = config
+    server = ThreadingHTTPServer((host, port), FakeSkapiecHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local fake of skapiec.pl.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--results', type=int, default=10, help='products on the search page')
+    parser.add_argument('--offers', type=int, default=15, help='offers on the offers page')
+    parser.add_argument('--stores', type=int, default=40, help='number of stores, fewer means more overlap')
+    parser.add_argument('--free-delivery', type=float, default=0.3)
+    parser.add_argument('--no-delivery', type=float, default=0.1)
+    parser.add_argument('--not-found', type=float, default=0.05)
+    parser.add_argument('--latency', choices=LATENCIES, default='none')
+    parser.add_argument('--latency-scale', type=float, default=0.05)
+    parser.add_argument('--padding', type=int, default=0, help='bytes of filler markup of every page')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=None, help='requests served at the same time')
+    args = parser.parse_args(argv)
+
+    config = SiteConfig(args.results, args.offers, args.stores, args.free_delivery, args.no_delivery, args.not_found,
+                        args.latency, args.latency_scale, args.padding, args.seed, args.concurrency)
+    server = serve(config, args.host, args.port)
+    logging.info(f'[FAKE_SKAPIEC] serving on http://{args.host}:{server.server_port}')
+    try:
+        while True:
+            time.sleep(60)
+            logging.info(f'[FAKE_SKAPIEC] requests: {FakeSkapiecHandler.requests}')
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    main()
@@ -42,8 +42,8 @@ class ProductForm(FlaskForm):
     submit_add = SubmitField('Dodaj')
     submit_search = SubmitField('Wyszukaj')
 
-    def validate(self):
-        if not FlaskForm.validate(self):
+    def validate(self, *args, **kwargs):     # WTForms 3 passes extra_validators
+        if not FlaskForm.validate(self, *args, **kwargs):
             return False
         min_price = self.min_price.data
         max_price = self.max_price.data
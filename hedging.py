@@ -0,0 +1,230 @@
+"""
+Per-request deadlines and hedged requests.
+Every request runs in a thread of a bounded pool and the caller waits for it at most the deadline of its page type.
+Requests are given the same deadline, so a request abandoned by its caller (late primary, losing duplicate) ends
+with it, and requests queued in the pool are dropped when their caller gives up. Number of requests running
+at the same time, abandoned ones included, never exceeds HEDGE_MAX_THREADS.
+If the request has not answered by HEDGE_PERCENTILE of recent latencies of the same page type,
+the duplicate is sent and the first answer is used. Number of duplicates is limited to HEDGE_MAX_RATIO
+of all requests, so hedging can not multiply the load of the site.
+
+Validation against local server with heavy-tailed latency:
+python hedging.py --requests 300
+"""
+from settings import *
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import math
+import threading
+import time
+import tracing
+
+
+class LatencyTracker:
+    """ Rolling window of latencies of one page type """
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, latency):
+        with self.lock:
+            self.samples.append(latency)
+
+    def percentile(self, p, min_samples=HEDGE_MIN_SAMPLES):
+        """
+        :param p:           (float) : percentile in range (0, 100]
+        :return:            (float) : latency in seconds, None if there are not enough samples
+        """
+        with self.lock:
+            if len(self.samples) < min_samples:
+                return None
+            samples = sorted(self.samples)
+        return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+
+class Hedger:
+    """
+    Runs requests with deadlines and hedging, see module documentation.
+    """
+
+    def __init__(self, enabled=HEDGE_ENABLED, percentile=HEDGE_PERCENTILE, max_ratio=HEDGE_MAX_RATIO,
+                 max_threads=HEDGE_MAX_THREADS):
+        """
+        :param enabled:     (boolean)   : if False duplicates are never sent, deadlines are still applied
+        :param percentile:  (float)     : percentile of latencies after which the duplicate is sent
+        :param max_ratio:   (float)     : max number of duplicates per request
+        :param max_threads: (int)       : max number of requests running at the same time
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.trackers = {}      # map {page type: LatencyTracker}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0         # duplicates sent
+        self.hedge_wins = 0     # duplicates that answered first
+        self.deadline_misses = 0
+        self.abandoned = 0      # requests still running after their caller has returned
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='hedger')
+
+    def tracker(self, kind):
+        with self.lock:
+            return self.trackers.setdefault(kind, LatencyTracker())
+
+    def hedge_delay(self, kind):
+        if not self.enabled:
+            return None
+        return self.tracker(kind).percentile(self.percentile)
+
+    def allow_hedge(self):
+        with self.lock:
+            if self.hedges >= self.max_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def start(self, kind, fn, args):
+        """
+        Runs fn(*args) in the pool, latencies of successful requests are recorded.
+        :return:    (Future)    :
+        """
+        tracker = self.tracker(kind)
+
+        def request():
+            start = time.time()
+            result = fn(*args)
+            if result is not None:
+                tracker.add(time.time() - start)
+            return result
+
+        return self.executor.submit(tracing.wrap(request))
+
+    def abandon(self, futures):
+        """
+        Drops requests the caller does not wait for any more, queued ones are not sent at all.
+        """
+        running = [future for future in futures if not future.cancel() and not future.done()]
+        if not running:
+            return
+        with self.lock:
+            self.abandoned += len(running)
+        for future in running:
+            future.add_done_callback(self.abandoned_done)
+
+    def abandoned_done(self, _):
+        with self.lock:
+            self.abandoned -= 1
+
+    def run(self, kind, deadline, fn, *args):
+        """
+        Calls fn(*args) with the deadline, sends duplicate if it is late.
+        :param kind:        (str)       : page type ('search', 'offers', 'delivery'), latencies are tracked per type
+        :param deadline:    (float)     : max time of waiting in seconds, None means no limit
+        :param fn:          (callable)  : function that sends the request, it returns None if request has failed,
+                                          it should end by the deadline (abandoned requests hold threads of the pool)
+        :return:                        : first not None result, None if all requests failed or deadline has passed
+        """
+        with self.lock:
+            self.requests += 1
+        start = time.time()
+        end = None if deadline is None else start + deadline
+        delay = self.hedge_delay(kind)
+        hedge_at = None if delay is None else start + delay
+        primary = self.start(kind, fn, args)
+        pending = {primary}
+
+        while pending:
+            wake_at = min((t for t in (hedge_at, end) if t is not None), default=None)
+            timeout = None if wake_at is None else max(0.0, wake_at - time.time())
+            done, pending = wait(pending, timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is not None:
+                    if future is not primary:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    self.abandon(pending)
+                    return result
+
+            now = time.time()
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if pending and self.allow_hedge():
+                    with tracing.span('hedge', kind=kind, delay=delay):
+                        pending.add(self.start(kind, fn, args))
+            if end is not None and now >= end:
+                with self.lock:
+                    self.deadline_misses += 1
+                self.abandon(pending)
+                return None
+        return None
+
+    def stats(self):
+        with self.lock:
+            trackers = dict(self.trackers)
+            stats = {'requests': self.requests, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins,
+                     'deadline_misses': self.deadline_misses, 'abandoned': self.abandoned}
+        stats['p' + str(self.percentile)] = {kind: tracker.percentile(self.percentile)
+                                             for kind, tracker in trackers.items()}
+        return stats
+
+
+def deadline(kind, ctx=None):
+    """
+    Returns deadline of one request of the page type, it never exceeds time left for scraping.
+    """
+    default = REQUEST_DEADLINES.get(kind, REQUEST_TIMEOUT)
+    return ctx.timeout(default) if ctx else default
+
+
+if __name__ == '__main__':
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from concurrent.futures import ThreadPoolExecutor
+    from requests import get
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description='Compares latency of requests with and without hedging.')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--alpha', type=float, default=1.5, help='shape of Pareto distribution of latencies')
+    parser.add_argument('--scale', type=float, default=0.02, help='minimal latency in seconds')
+    parser.add_argument('--deadline', type=float, default=3)
+    args = parser.parse_args()
+
+    class SlowHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(min(args.scale * random.paretovariate(args.alpha), 10))
+            body = b'<html><body>ok</body></html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/'
+
+    def fetch(_):
+        with get(url, timeout=args.deadline) as resp:
+            return resp.content
+
+    def measure(hedger):
+        def one(_):
+            start = time.time()
+            hedger.run('page', args.deadline, fetch, None)
+            return time.time() - start
+        with ThreadPoolExecutor(args.workers) as executor:
+            latencies = sorted(executor.map(one, range(args.requests)))
+        return {p: round(latencies[math.ceil(p / 100 * len(latencies)) - 1] * 1000, 1) for p in (50, 90, 99, 100)}
+
+    random.seed(0)
+    for name, hedger in (('no hedging', Hedger(enabled=False)), ('hedging', Hedger())):
+        result = measure(hedger)
+        print(f'{name:>10}: latency ms {result}, {hedger.stats()}')
+    server.shutdown()
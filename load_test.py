@@ -0,0 +1,154 @@
+"""
+Load test of the web app: virtual users send mixed add / search / delete traffic and the driver reports
+throughput and latency percentiles of every operation.
+Run it against the app scraping the local fake site (see fake_skapiec.py), never against skapiec.pl.
+
+Usage:
+python fake_skapiec.py --port 8001 --latency pareto --latency-scale 0.05
+SKAPIEC_URL=http://127.0.0.1:8001 python routes2.py
+python load_test.py --app http://127.0.0.1:5000 --users 8 --duration 60 --mix add=4,search=2,delete=3
+"""
+from requests import Session
+from requests.exceptions import RequestException
+from settings import MAX_BASKET_PRODUCTS
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+DELETE_LINK = re.compile(r'/delete/(\d+)')
+
+
+class LoadStats:
+    """ Latencies and errors of every operation """
+
+    def __init__(self):
+        self.latencies = {}     # map {operation: list of latencies in seconds}
+        self.errors = {}        # map {operation: number of failed operations}
+        self.lock = threading.Lock()
+
+    def add(self, op, latency, ok):
+        with self.lock:
+            self.latencies.setdefault(op, []).append(latency)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def report(self, duration):
+        """
+        :param duration:    (float) : duration of the test in seconds
+        :return:            (dict)  : map {operation: {count, errors, throughput, p50, p90, p99, max}}, times in ms
+        """
+        with self.lock:
+            latencies = {op: sorted(values) for op, values in self.latencies.items()}
+            latencies['all'] = sorted(v for values in self.latencies.values() for v in values)
+            errors = dict(self.errors, all=sum(self.errors.values()))
+        report = {}
+        for op, values in latencies.items():
+            if not values:
+                continue
+            report[op] = {'count': len(values), 'errors': errors.get(op, 0),
+                          'throughput': round(len(values) / duration, 2), 'max': round(values[-1] * 1000, 1)}
+            for p in (50, 90, 99):
+                report[op][f'p{p}'] = round(values[max(0, math.ceil(p / 100 * len(values)) - 1)] * 1000, 1)
+        return report
+
+
+class VirtualUser:
+    """ One client of the app with its own session (cookies, csrf token), so with its own basket """
+
+    def __init__(self, app_url, queries, mix, stats, seed=0, timeout=120):
+        self.app_url = app_url.rstrip('/')
+        self.queries = queries
+        self.ops, self.weights = zip(*mix.items())
+        self.stats = stats
+        self.rng = random.Random(seed)
+        self.timeout = timeout
+        self.session = Session()
+
+    def run(self, end_time):
+        while time.time() < end_time:
+            op = self.rng.choices(self.ops, self.weights)[0]
+            start = time.time()
+            try:
+                ok = getattr(self, op)()
+            except RequestException:
+                ok = False
+            self.stats.add(op, time.time() - start, ok)
+
+    def home(self):
+        return self.session.get(self.app_url + '/', timeout=self.timeout)
+
+    def add(self):
+        """
+        Adds product to the basket, it succeeds only if the basket page shows the new product afterwards.
+        """
+        page = self.home().text
+        pids = set(DELETE_LINK.findall(page))
+        if len(pids) >= MAX_BASKET_PRODUCTS:
+            return True
+        token = CSRF_TOKEN.search(page)
+        query = self.queries[min(int(self.rng.paretovariate(1.2)) - 1, len(self.queries) - 1)]   # popular first
+        resp = self.session.post(self.app_url + '/', timeout=self.timeout, data={
+            'csrf_token': token.group(1) if token else '', 'name': query, 'count': self.rng.randint(1, 3),
+            'min_price': 0, 'max_price': 99999, 'min_rating': 0, 'nrates': 0, 'submit_add': 'Dodaj'})
+        return resp.ok and bool(set(DELETE_LINK.findall(resp.text)) - pids) and query in resp.text
+
+    def search(self):
+        return self.session.post(self.app_url + '/search', timeout=self.timeout).ok
+
+    def delete(self):
+        pids = DELETE_LINK.findall(self.home().text)
+        if not pids:
+            return True
+        return self.session.get(f'{self.app_url}/delete/{self.rng.choice(pids)}', timeout=self.timeout).ok
+
+
+def parse_mix(mix):
+    """
+    :param mix:     (str)   : weights of operations, e.g. "add=4,search=2,delete=3"
+    :return:        (dict)  : map {operation: weight}
+    """
+    weights = {}
+    for part in mix.split(','):
+        op, _, weight = part.partition('=')
+        if op not in ('add', 'search', 'delete'):
+            raise argparse.ArgumentTypeError(f'unknown operation: {op}')
+        weights[op] = float(weight or 1)
+    return weights
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of the web app.')
+    parser.add_argument('--app', default='http://127.0.0.1:5000', help='url of the app')
+    parser.add_argument('--users', type=int, default=8, help='number of concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=60, help='seconds')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('add=4,search=2,delete=3'))
+    parser.add_argument('--queries', type=int, default=50, help='number of distinct product names')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    queries = [f'produkt {k}' for k in range(args.queries)]
+    stats = LoadStats()
+    end_time = time.time() + args.duration
+    users = [VirtualUser(args.app, queries, args.mix, stats, args.seed + k) for k in range(args.users)]
+    threads = [threading.Thread(target=user.run, args=(end_time,), daemon=True) for user in users]
+    start = time.time()
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+
+    report = stats.report(time.time() - start)
+    print(json.dumps(report, indent=2))
+    try:
+        print(json.dumps(users[0].session.get(args.app.rstrip('/') + '/stats', timeout=10).json(), indent=2))
+    except (RequestException, ValueError):
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
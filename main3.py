@@ -1,4 +1,17 @@
 from scraper2 import *
+from solver import LargeBasketSolver
+from context import SearchContext
+from budget import BudgetPlanner
+from cache import TTLCache, normalize_query
+from singleflight import SingleFlight
+from offer_store import OfferStore
+from store_index import StoreIndex
+from relevance import rank_overviews
+import tracing
+from concurrent.futures import ThreadPoolExecutor, wait
+import copy
+import itertools
+import sqlite3
 import time
 import threading
 import logging
@@ -8,16 +21,39 @@ from exceptions import *
 NULL_PRODUCT = Product(-100, '', 0, [0.00], 0, 0, 'link/red/9999999/1', '')
 # ^&%^G&T^%^& returns results :)
 
+QUERY_FLIGHTS = SingleFlight('query')       # concurrent searches of the same query share one ProductList
+OFFER_STORE = OfferStore() if OFFER_STORE_ENABLED else None
+
 
 class SkapiecOptimizer:
 
-    def __init__(self):
+    def __init__(self, coordinator=None):
+        """
+        :param coordinator: (ScrapeCoordinator) : products are scrapped by worker processes (see workers.py)
+        """
+        self.coordinator = coordinator
         self.scrap_threads = []
         self.scraper = SkapiecScraper()
         self.in_products = []   # list of user requirements
-        self.req_id = 1
+        self.req_ids = itertools.count(1)     # shared by baskets (see new_basket), so ids are unique
+        self.offers_cache = TTLCache(OFFERS_CACHE_TTL, OFFERS_CACHE_SIZE)     # map {normalized query: ProductList}
+        self.prefetches = {}    # map {normalized query: Prefetch}
+        self.prefetch_lock = threading.Lock()
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+
+    def new_basket(self):
+        """
+        Returns optimizer with its own empty basket, which shares caches, prefetches and scrapers with this one,
+        e.g. one per user of the web app.
+        :return:    (SkapiecOptimizer)  :
+        """
+        optimizer = copy.copy(self)
+        optimizer.in_products = []
+        return optimizer
 
     def clear_products(self):
+        for user_req in self.in_products:
+            self.cancel_prefetch(user_req)
         self.in_products = []
 
     def add_product(self, name, count, min_price, max_price, min_rating, nrates):
@@ -31,15 +67,91 @@ class SkapiecOptimizer:
         :param nrates:
         :return:
         """
-        if len(self.in_products) >= 5:
-            logging.warning('[ADD_PRODUCT] You can not add more then 5 products to the cart')
+        if len(self.in_products) >= MAX_BASKET_PRODUCTS:
+            logging.warning(f'[ADD_PRODUCT] You can not add more then {MAX_BASKET_PRODUCTS} products to the cart')
             return False
 
-        user_req = UserRequirements(self.req_id, name, count, min_price, max_price, min_rating, nrates)
-        self.req_id += 1
+        user_req = UserRequirements(next(self.req_ids), name, count, min_price, max_price, min_rating, nrates)
         self.in_products.append(user_req)
+        if PREFETCH_ENABLED:
+            self.prefetch(user_req)
         return True
 
+    def search_depth(self):
+        """
+        Returns number of offers and stores per product that are scrapped for current basket.
+        :return:    (tuple) : max offers (int), max stores (int)
+        """
+        if len(self.in_products) > LARGE_BASKET_THRESHOLD:
+            return LARGE_BASKET_MAX_OFFERS, LARGE_BASKET_MAX_STORES
+        return MAX_OFFERS, MAX_STORES
+
+    def prefetch(self, user_req):
+        """
+        Starts scraping offers of the product in the background, while user is still filling the basket.
+        Loaded offers are put into offers cache, search() joins prefetches that are still running.
+        :param user_req:    (UserRequirements)  :
+        :return:
+        """
+        query = normalize_query(user_req.name)
+        max_offers, max_stores = self.search_depth()
+        if self.get_cached(query, max_offers, max_stores):
+            return
+
+        with self.prefetch_lock:
+            prefetch = self.prefetches.get(query)
+            if prefetch:
+                prefetch.pids.add(user_req.pid)
+                return
+            ctx = SearchContext(PREFETCH_MAX_TIME, find_time=0, tenant='prefetch', weight=BACKGROUND_WEIGHT)
+            future = self.prefetch_executor.submit(self.search_product, query, max_offers, max_stores, ctx)
+            prefetch = Prefetch(future, ctx, user_req.pid, max_offers, max_stores)
+            self.prefetches[query] = prefetch
+        logging.info(f'[PREFETCH] started prefetch of "{query}"')
+        future.add_done_callback(lambda f: self.prefetch_done(query, prefetch))
+
+    def prefetch_done(self, query, prefetch):
+        if prefetch.ctx.cancelled.is_set() or prefetch.future.cancelled():
+            return
+        plist = prefetch.future.result()
+        if plist.complete:
+            self.offers_cache.put(query, plist)
+        logging.info(f'[PREFETCH] prefetch of "{query}" finished')
+
+    def cancel_prefetch(self, user_req):
+        """
+        Cancels prefetch of removed product, unless other product in the basket has the same name.
+        :param user_req:    (UserRequirements)  :
+        :return:
+        """
+        query = normalize_query(user_req.name)
+        with self.prefetch_lock:
+            prefetch = self.prefetches.get(query)
+            if not prefetch:
+                return
+            prefetch.pids.discard(user_req.pid)
+            if prefetch.pids:
+                return
+            del self.prefetches[query]
+        prefetch.future.cancel()
+        prefetch.ctx.cancel()
+        logging.info(f'[PREFETCH] prefetch of "{query}" cancelled')
+
+    def remove_prefetch(self, query, prefetch):
+        with self.prefetch_lock:
+            if self.prefetches.get(query) is prefetch:
+                del self.prefetches[query]
+
+    def get_prefetch(self, query, max_offers, max_stores):
+        """
+        Returns running prefetch of the query if it scraps at least given number of offers and stores.
+        """
+        with self.prefetch_lock:
+            prefetch = self.prefetches.get(query)
+        if prefetch and prefetch.max_offers >= max_offers and prefetch.max_stores >= max_stores:
+            return prefetch
+        return None
+
     def remove_product(self, pid):
         """
         Remove product from user's basket
@@ -51,76 +163,294 @@ class SkapiecOptimizer:
             user_req = self.in_products[k]
             if user_req.pid == pid:
                 self.in_products.remove(user_req)
+                self.cancel_prefetch(user_req)
                 return True
         return False
 
-    def search(self):
-        # Iterate through user's shopping basket and search for offers
-        for user_req in self.in_products:
-            plist = ProductList(user_req.name, user_req.count, self.scraper)
-            try:
-                plist.load_products()
-            except ProductNotFoundException:
-                logging.info('[SEARCH] Product "{}" not found'.format(user_req.name))
-            user_req.found_products = plist
+    @tracing.traced('search')
+    def search(self, max_time=MAX_TIME, refresh=False, max_requests=SEARCH_REQUEST_BUDGET, tenant=None):
+        """
+        Search for offers of every product in user's shopping basket.
+        Offers are scrapped once per normalized query and cached (OFFERS_CACHE_TTL), so searching again
+        after changing requirements, count or basket composition does not scrap the site again.
+        Products prefetched by add_product are taken from the cache or joined if still loading.
+        Products are scrapped in parallel (every product has its own scraper), big baskets are scrapped
+        with smaller number of offers and stores per product.
+        Search is stopped when deadline is exceeded, products that have not been loaded till then
+        get offers found so far (or none) and the search is marked as partial.
+        :param max_time:    (float)     : deadline of search and find_best in seconds, None means no deadline
+        :param refresh:     (boolean)   : if True cached offers are ignored and scrapped again
+        :param max_requests:(int)       : http requests of the search handed out by BudgetPlanner, None means no limit
+        :param tenant:      (str)       : owner of the search in the request scheduler, e.g. session of the user
+        :return:            (tuple)     : searched user requirements and SearchContext of the search, both should be
+                                          passed to find_best (optimizer is shared, so the context is not kept in it)
+        """
+        planner = BudgetPlanner(max_requests) if max_requests else None
+        ctx = SearchContext(max_time, budget=planner, tenant=tenant)
+        max_offers, max_stores = self.search_depth()
+
+        queries = {}        # map {normalized query: list of user requirements}
+        searched = list(self.in_products)      # products added during the search are not searched
+        for user_req in searched:
+            queries.setdefault(normalize_query(user_req.name), []).append(user_req)
+
+        plists = {}         # map {normalized query: ProductList}
+        for query in queries:
+            if refresh:
+                SEARCH_CACHE.invalidate(query)      # overviews hold prices, so they are scrapped again too
+            cached = None if refresh else self.get_cached(query, max_offers, max_stores)
+            if cached:
+                plists[query] = cached
+        to_scrap = [query for query in queries if query not in plists]
+        logging.info(f'[SEARCH] {len(plists)} product(s) loaded from cache, {len(to_scrap)} to scrap')
+
+        if to_scrap:
+            executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+            futures = {}
+            prefetches = {query: None if refresh else self.get_prefetch(query, max_offers, max_stores)
+                          for query in to_scrap}
+            if planner:
+                [planner.add_item(query, queries[query]) for query in to_scrap if not prefetches[query]]
+            for query in to_scrap:
+                prefetch = prefetches[query]
+                if prefetch:
+                    futures[prefetch.future] = query        # join prefetch instead of scraping again
+                    self.remove_prefetch(query, prefetch)
+                else:
+                    futures[executor.submit(tracing.wrap(self.search_product), query, max_offers, max_stores,
+                                            ctx, refresh)] = query
+            done, not_done = wait(futures, timeout=ctx.remaining())
+            executor.shutdown(wait=False)       # do not wait for abandoned threads
+
+            for future, query in futures.items():
+                if future in done and not future.cancelled():
+                    plists[query] = future.result()
+                    if plists[query].complete and not plists[query].pruned:
+                        self.offers_cache.put(query, plists[query])
+                else:
+                    ctx.mark_partial(f'product "{query}" has not been loaded')
+                    plists[query] = ProductList(query, DEFAULT_COUNT, None)
 
-    def find_best(self):        # !TODO search() can be moved here
-        algorithm_handler = AlgorithmHandler(self.in_products)
-        return algorithm_handler.find(), algorithm_handler.msgs
+        if planner:
+            logging.info(f'[SEARCH] request budget: {planner.stats()}')
+        for query, user_reqs in queries.items():
+            for user_req in user_reqs:
+                user_req.found_products = plists[query].copy_for(user_req)
+        return searched, ctx
+
+    def get_cached(self, query, max_offers, max_stores):
+        """
+        Returns cached ProductList of the query if it has been scrapped with at least given number
+        of offers and stores.
+        :param query:   (str)   : normalized query
+        :return:        (ProductList)   : None if there is no such list in the cache
+        """
+        cached = self.offers_cache.get(query)
+        if cached and cached.max_offers >= max_offers and cached.max_stores >= max_stores:
+            return cached
+        return None
+
+    def search_product(self, name, max_offers=MAX_OFFERS, max_stores=MAX_STORES, ctx=None, refresh=False):
+        """
+        Scraps offers of one product. If the same product is being scrapped at the same time
+        (by another basket or another user), waits for it and returns its ProductList.
+        :param refresh: (boolean)   : if True offers are not read from the offer store
+        :return:        (ProductList)   :
+        """
+        key = (normalize_query(name), max_offers, max_stores, ctx.planner if ctx else None,   # planned lists differ
+               refresh)
+        timeout = ctx.remaining() if ctx else None
+        load = self.coordinator.load_product_list if self.coordinator else self.load_product_list
+        with tracing.span('item', query=name):
+            plist = QUERY_FLIGHTS.do(key, load, name, max_offers, max_stores, ctx, refresh, timeout=timeout,
+                                     shared=lambda p: p.complete or p.not_found)     # failures are not shared
+        if plist is None:       # product scrapped by another search has not been loaded on time
+            ctx.mark_partial(f'product "{name}" has not been loaded')
+            plist = ProductList(name, DEFAULT_COUNT, None, max_offers, max_stores)
+        return plist
+
+    @staticmethod
+    def load_product_list(name, max_offers, max_stores, ctx, refresh=False):
+        plist = ProductList(name, DEFAULT_COUNT, SkapiecScraper(), max_offers, max_stores, ctx, OFFER_STORE)
+        try:
+            plist.load_products(refresh)
+        except ProductNotFoundException:
+            logging.info('[SEARCH] Product "{}" not found'.format(name))
+        return plist
+
+    @tracing.traced('find')
+    def find_best(self, user_reqs=None, ctx=None):        # !TODO search() can be moved here
+        """
+        :param user_reqs:   (list)          : user requirements returned by search, basket may have changed since
+        :param ctx:         (SearchContext) : context returned by search, it limits time of the algorithm
+        :return:            (tuple)         : list of result sets, list of messages
+        """
+        time_budget = SOLVER_TIME_BUDGET
+        if ctx and ctx.find_remaining() is not None:
+            time_budget = min(time_budget, ctx.find_remaining())
+        algorithm_handler = AlgorithmHandler(self.in_products if user_reqs is None else user_reqs, time_budget)
+        results = algorithm_handler.find()
+        if ctx and ctx.partial:
+            algorithm_handler.msgs.append('Wyniki częściowe: nie wszystkie oferty zostały pobrane w wymaganym czasie')
+        return results, algorithm_handler.msgs
+
+
+class Prefetch:
+    """ Scraping of one product started before search """
+
+    def __init__(self, future, ctx, pid, max_offers, max_stores):
+        self.future = future        # future of ProductList
+        self.ctx = ctx
+        self.pids = {pid}           # ids of user requirements that wait for the prefetch
+        self.max_offers = max_offers
+        self.max_stores = max_stores
 
 
 class ProductList:
     """ List of offers of one product """
 
-    def __init__(self, pname, count, scraper):
+    def __init__(self, pname, count, scraper, max_offers=MAX_OFFERS, max_stores=MAX_STORES, ctx=None, store=None):
         self.pname = pname
         self.count = count
         self.scraper = scraper
+        self.max_offers = max_offers
+        self.max_stores = max_stores
+        self.ctx = ctx
+        self.store = store      # OfferStore, fresh offers are read from it instead of scraping
         self.scrap_threads = []
         self.products_list = []
-
-    def load_products(self):
+        self.lock = threading.Lock()
+        self.closed = False     # True if threads that are still running can not add products
+        self.complete = False   # True if all offers were loaded before the deadline
+        self.not_found = False  # True if search page returned no products
+        self.pruned = False     # True if BudgetPlanner has skipped offers, the list fits requirements of one search
+        self.unplanned = []     # indexes of relevant products overview not planned by BudgetPlanner
+
+    def load_products(self, refresh=False):
         """
         Main method it should be called after class initialization.
         It loads the maximum number of offers and stores that were specified in settings.
         Loaded products are saved in a list and returned.
         It can throw ProductNotFoundException if there is no product with specified name.
         It can return an empty list if all stores have not specified delivery costs.
-        :return:    (list)  : sorted list of products (sort by total minimum price)
+        If offer store is given, fresh offers are read from it and scraped offers are saved into it.
+        :param refresh: (boolean)   : if True offers are scraped even if the store has fresh ones
+        :return:        (list)      : sorted list of products (sort by total minimum price)
         """
-        if not self.init_scraper():
-            raise ProductNotFoundException()
-
-        self.init_threads()
-        self.start_threads()
+        if not refresh and self.load_stored_products():
+            logging.info(f'[LOAD_PRODUCTS] offers of "{self.pname}" loaded from offer store')
+        else:
+            if not self.init_scraper():
+                if self.ctx and self.ctx.planner:
+                    self.ctx.planner.finish(normalize_query(self.pname))
+                if not self.scraper.not_found:     # search page has not been loaded, the list is not complete
+                    logging.warning(f'[LOAD_PRODUCTS] search page of "{self.pname}" has not been loaded')
+                    if self.ctx:
+                        self.ctx.mark_partial(f'search page of "{self.pname}" has not been loaded')
+                    return self.products_list
+                self.not_found = True
+                raise ProductNotFoundException()
+
+            self.init_threads()
+            self.start_threads()
+            self.complete = self.ctx is None or not self.ctx.expired()
+            if self.complete and self.store and not self.pruned:
+                self.save_products()
 
         self.products_list.sort(key=lambda x: (x.total_min_price, -x.rating), reverse=False)     # !TODO
         # [print(p) for p in self.products_list]
         return self.products_list
 
+    def save_products(self):
+        try:
+            self.store.save(self.pname, self.scraper.get_products_overview(), self.products_list,
+                            self.max_offers, self.max_stores)
+        except sqlite3.Error as e:
+            logging.error(f'[SAVE_PRODUCTS] error while writing offer store: {e}')
+
+    def load_stored_products(self):
+        """
+        Loads fresh offers from the offer store.
+        :return:    (boolean)   : True if offers were found in the store
+        """
+        if not self.store:
+            return False
+        try:
+            offers = self.store.load(self.pname, self.max_offers, self.max_stores)
+        except sqlite3.Error as e:
+            logging.error(f'[LOAD_STORED_PRODUCTS] error while reading offer store: {e}')
+            return False
+        if offers is None:
+            return False
+
+        pid = next_product_id()
+        for offer in offers:
+            p = Product(pid, offer['name'], offer['price'], offer['delivery_costs'], offer['rating'],
+                        offer['rating_count'], offer['link'], offer['shop_name'])
+            p.count = self.count
+            p.overview_idx = offer['overview_idx']
+            self.products_list.append(p)
+        self.complete = True
+        return True
+
     def init_scraper(self):
         """
         Initialize scraper - load search results
         :return:
         """
-        if self.scraper.load_page(self.pname):
+        if self.scraper.load_page(self.pname, self.ctx):
             return True
         else:
             return False
 
     def init_threads(self):
-        offers = self.scraper.get_stores_num()
-        offers = offers if offers <= MAX_OFFERS else MAX_OFFERS
-
-        for k in range(offers):
-            x = threading.Thread(target=self.get_offer, args=(k,))      # k - index of offer
+        """
+        Creates threads scraping offers of the most relevant products of the search page (see relevance.py).
+        """
+        overviews = self.scraper.get_products_overview()
+        if RELEVANCE_ENABLED:
+            indexes = rank_overviews(self.pname, overviews)
+        else:
+            indexes = list(range(len(overviews)))
+
+        count = self.max_offers
+        if self.ctx and self.ctx.planner:
+            count = self.ctx.planner.plan_offers(normalize_query(self.pname), [overviews[k] for k in indexes],
+                                                 self.max_offers, self.max_stores)
+        self.unplanned = indexes[count:self.max_offers]
+        for k in indexes[:count]:
+            x = threading.Thread(target=tracing.wrap(self.get_offer), args=(k,), daemon=True)  # k - index of offer
             self.scrap_threads.append(x)
 
     def start_threads(self):
         [x.start() for x in self.scrap_threads]
-        [x.join() for x in self.scrap_threads]
+        for x in self.scrap_threads:
+            x.join(self.ctx.remaining() if self.ctx else None)
+        if self.ctx and self.ctx.planner:
+            self.scrap_unplanned(self.ctx.planner)
+
+        with self.lock:
+            self.closed = True
+            if self.ctx and any(x.is_alive() for x in self.scrap_threads):
+                self.ctx.mark_partial(f'offers of "{self.pname}" have not been loaded')
         logging.info('[SkapiecOptimazer] products have been loaded')
 
+    def scrap_unplanned(self, planner):
+        """
+        Scraps offers pages that were not planned while the search has free requests (see BudgetPlanner).
+        """
+        query = normalize_query(self.pname)
+        overviews = self.scraper.get_products_overview()
+        self.unplanned.sort(key=lambda k: overviews[k]['min_price'])        # cheapest first
+        while self.unplanned and not self.ctx.expired():
+            if not planner.allow_page(query, overviews[self.unplanned[0]]['min_price']):
+                break       # the cheapest offer of the rest can not improve the result
+            if not planner.more_offers(query, self.max_stores):
+                break
+            self.get_offer(self.unplanned.pop(0))
+        planner.finish(query)
+        self.pruned = bool(self.unplanned) or planner.pruned(query)
+
     def get_offer(self, k):
         """
         Scrap one offer
@@ -129,14 +459,58 @@ class ProductList:
         """
         try:
             ds = self.scraper.load_product_stores(k)
-            products = ds.scrap_nstores(MAX_STORES)
+            planner, query = self.ctx.planner if self.ctx else None, normalize_query(self.pname)
+            products = ds.scrap_nstores(self.max_stores, allow=planner and (lambda row: planner.allow_row(query, row)))
+            if planner:
+                planner.add_products(query, products)
             for p in products:
                 p.count = self.count
-            self.products_list.extend(products)
+                p.overview_idx = k
+            with self.lock:
+                if not self.closed:     # thread was abandoned, results are too late
+                    self.products_list.extend(products)
 
         except OutOfBoundException as e:
             logging.error(f'[GET_OFFER] scraper cannot load offer with index k={k}, {str(e)}')
 
+    def copy_for(self, user_req):
+        """
+        Returns a copy of the list with copies of products, that belong to the user requirements
+        (product id and count are taken from user_req). Cached lists are shared between searches,
+        so products must not be modified.
+        :param user_req:    (UserRequirements)  :
+        :return:            (ProductList)       :
+        """
+        plist = ProductList(self.pname, user_req.count, None, self.max_offers, self.max_stores)
+        for p in self.products_list:
+            product = copy.copy(p)
+            product.pid = user_req.pid
+            product.count = user_req.count
+            plist.products_list.append(product)
+        plist.complete = self.complete
+        plist.not_found = self.not_found
+        return plist
+
+    def to_dict(self):
+        """ Compact form of the list used by cache snapshots """
+        return {'pname': self.pname, 'max_offers': self.max_offers, 'max_stores': self.max_stores,
+                'complete': self.complete, 'not_found': self.not_found,
+                'products': [dict(p.to_dict(), overview_idx=p.overview_idx) for p in self.products_list]}
+
+    @staticmethod
+    def from_dict(data):
+        plist = ProductList(data['pname'], DEFAULT_COUNT, None, data['max_offers'], data['max_stores'])
+        pid = next_product_id()
+        for offer in data['products']:
+            p = Product(pid, offer['name'], offer['price'], offer['delivery_costs'], offer['rating'],
+                        offer['rating_count'], offer['link'], offer['shop_name'])
+            p.count = offer['count']
+            p.overview_idx = offer['overview_idx']
+            plist.products_list.append(p)
+        plist.complete = data['complete']
+        plist.not_found = data['not_found']
+        return plist
+
     def apply_requirements(self, min_price=DEFAULT_MIN_PRICE, max_price=DEFAULT_MAX_PRICE,
                            min_rating=DEFAULT_RATING, nrates=DEFAULT_MIN_NRATES):
         """
@@ -169,14 +543,21 @@ class UserRequirements:
         self.nrates = nrates
         self.found_products = []
 
+    def accepts(self, price, rating, rating_count):
+        """ True if the offer meets requirements, the same condition as ProductList.apply_requirements """
+        return self.max_price > price > self.min_price and rating > self.min_rating and rating_count > self.nrates
+
 
 class AlgorithmHandler:
 
-    def __init__(self, in_products):
+    def __init__(self, in_products, time_budget=SOLVER_TIME_BUDGET):
         self.in_products = in_products
+        self.time_budget = time_budget  # time limit of the solver used for big baskets
         self.dummy_cheapest = []
         self.msgs = []
         self.possible_offers = []       # list of ResultSets
+        self.gap = None                 # distance from lower bound (only for big baskets)
+        self.store_index = StoreIndex()     # offers that meet requirements, indexed by store
 
     def load_cheapest_products(self, processed_products):
         """
@@ -200,6 +581,7 @@ class AlgorithmHandler:
 
     def find(self):
         self.msgs = []  # reset
+        self.store_index = StoreIndex()
         if not self.in_products:
             logging.warning('[FIND] in_products list is empty')
             return []
@@ -210,7 +592,10 @@ class AlgorithmHandler:
             plist = user_req.found_products
             if not plist.products_list:
                 processed_products.append([])
-                self.msgs.append(f'Nie znaleziono produktu: {user_req.name}')
+                if plist.not_found or plist.complete:
+                    self.msgs.append(f'Nie znaleziono produktu: {user_req.name}')
+                else:
+                    self.msgs.append(f'Nie udało się pobrać ofert produktu: {user_req.name}')
                 continue
 
             logging.info(f'[FIND] Start processing: {user_req.name}, input_len: {len(plist.products_list)}')
@@ -227,6 +612,10 @@ class AlgorithmHandler:
             else:
                 processed_products.append(filtered_plist)
                 logging.info(f'[FIND] product {user_req.name} meets requirements')
+            self.store_index.add_all(len(processed_products) - 1, processed_products[-1])
+
+        if len(processed_products) > LARGE_BASKET_THRESHOLD:
+            return self.find_large(processed_products, self.time_budget)
 
         self.load_cheapest_products(processed_products)
 
@@ -235,6 +624,28 @@ class AlgorithmHandler:
 
         return dummy_cheapest
 
+    def find_large(self, processed_products, time_budget=SOLVER_TIME_BUDGET):
+        """
+        Finds best sets of big basket using LargeBasketSolver.
+        :param processed_products:  (list)  : list of offers of every product
+        :param time_budget:         (float) : max time of the search in seconds
+        :return:                    (list)  : list of ResultSets
+        """
+        solver = LargeBasketSolver(processed_products, time_budget, store_index=self.store_index)
+        result_sets = []
+        for products in solver.solve():
+            result_set = ResultSet()
+            for idx, product in enumerate(products):
+                if product:
+                    product.in_id = idx
+                result_set.add_product(product)
+            result_set.calculate_total_price()
+            result_sets.append(result_set)
+
+        self.gap = solver.gap
+        self.msgs.append(f'Zestawy wyznaczone heurystycznie, maksymalna odległość od optimum: {solver.gap:.1%}')
+        return result_sets
+
     def reduce(self, products_list):
         """
         Leave only offer with lowest price from one shop and remove offers which have higher price without
@@ -260,39 +671,33 @@ class AlgorithmHandler:
                 stores_id.append(product.store_id)
         return out_offers
 
-    def create_offers(self, products_offers):
-        stores_map = {}
-        for offers in products_offers:  # create map {store_id: [product1, product2, ...]}
-            for offer in offers:
-                if offer.store_id not in stores_map.keys():
-                    stores_map[offer.store_id] = [offer]
-                else:
-                    stores_map[offer.store_id].append(offer)
-
-        reduced_stores_map = {}
-        # remove entries with only one element
-        for store_id, offers in stores_map.items():
-            if len(offers) > 1:
-                reduced_stores_map[store_id] = offers
-
-        if not reduced_stores_map:
+    def create_offers(self, products_offers=None):
+        """
+        Creates sets in which all the products that one store supplies are bought in that store.
+        :param products_offers: (list)  : list of offers of every product, if None offers indexed by find() are used
+        :return:                (list)  : list of ResultSets
+        """
+        store_index = self.store_index
+        if products_offers is not None:
+            store_index = StoreIndex()
+            for idx, offers in enumerate(products_offers):
+                store_index.add_all(idx, offers)
+
+        shared_stores = store_index.covering(2)     # stores that supply more than one product
+        if not shared_stores:
             return []
-        final_offers = self.make_offer(reduced_stores_map)
-
-        return final_offers
+        return self.make_offer(store_index, shared_stores)
 
-    def make_offer(self, reduced_stores_map):
+    def make_offer(self, store_index, stores_ids):
         final_offers = []
-        for store_id, products in reduced_stores_map.items():     # try to find a set of products form one store
-            pids = [product.pid for product in products]
-            not_in_map_products = []  # [product for product in self.dummy_cheapest.products if product.pid not in pids]
-            for product in self.dummy_cheapest.products:
-                if product:
-                    if product.pid not in pids:
-                        not_in_map_products.append(product
-                                                   )
+        for store_id in stores_ids:     # try to find a set of products form one store
+            store_offers = store_index.offers(store_id)     # map {product index: offer}
+            for idx, product in store_offers.items():
+                product.in_id = idx
+            not_in_map_products = [product for product in self.dummy_cheapest.products
+                                   if product and product.in_id not in store_offers]
             resultSet = ResultSet()
-            resultSet.add_products_list(products)
+            resultSet.add_products_list(store_offers.values())
             resultSet.add_products_list(not_in_map_products)
             resultSet.calculate_total_price()
             final_offers.append(resultSet)
@@ -372,7 +777,7 @@ class ResultSet:
         if pstore_id in self.deliveries.keys():
             self.deliveries[pstore_id].extend(product.delivery_costs)
         else:
-            self.deliveries[pstore_id] = product.delivery_costs
+            self.deliveries[pstore_id] = list(product.delivery_costs)     # copy, list is extended above
 
     def calculate_total_price(self):
         """
@@ -398,6 +803,13 @@ class ResultSet:
                 self.total_price += min(self.deliveries[store_id])
 
 
+    def to_dict(self):
+        """
+        Returns JSON serializable representation of the set, 'item' is index of the product in the basket.
+        """
+        return {'total_price': self.total_price,
+                'products': [dict(p.to_dict(), item=p.in_id) for p in self.products if p != NULL_PRODUCT]}
+
     def is_equal(self, other_set):
         """
         Returns True if other_set contains exactly (references equality) the same products
@@ -0,0 +1,70 @@
+"""
+Memory ceiling check of scraping: runs one search and one concurrent batch against the local fake site
+(see fake_skapiec.py) under tracemalloc and fails if the peak of traced memory exceeds the ceiling.
+Pages are padded to the size of real skapiec.pl pages, so parse trees weigh as much as in production.
+
+Usage:
+python memory_check.py --search-ceiling 20 --batch-ceiling 40
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+import fake_skapiec
+
+
+def measure(name, fn):
+    """
+    :return:    (tuple) : result of fn, peak of traced memory in MB, memory left after fn in MB
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    try:
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    print(f'{name:>7}: peak {peak / 2 ** 20:7.1f} MB, left {current / 2 ** 20:7.1f} MB, {time.time() - start:.2f}s')
+    return result, peak / 2 ** 20, current / 2 ** 20
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Checks memory ceiling of search and batch.')
+    parser.add_argument('--products', type=int, default=5, help='products of the searched basket')
+    parser.add_argument('--baskets', type=int, default=20, help='baskets of the batch')
+    parser.add_argument('--padding', type=int, default=100000, help='bytes of filler markup of every page')
+    parser.add_argument('--search-ceiling', type=float, default=20, help='MB')
+    parser.add_argument('--batch-ceiling', type=float, default=40, help='MB')
+    args = parser.parse_args(argv)
+
+    config = fake_skapiec.SiteConfig(results=args.products, offers=10, stores=30, padding=args.padding)
+    server = fake_skapiec.serve(config)
+    import settings
+    settings.URL = f'http://127.0.0.1:{server.server_port}'      # settings are imported by fake_skapiec already
+    settings.OFFER_STORE_ENABLED = False
+    settings.PREFETCH_ENABLED = False
+    from batch import BatchOptimizer
+    from main3 import SkapiecOptimizer, UserRequirements
+
+    so = SkapiecOptimizer()
+    for k in range(args.products):
+        so.add_product(f'produkt {k}', 1, 0, 99999, 0, 0)
+    _, search_peak, _ = measure('search', lambda: so.find_best(*so.search(max_time=None)))
+
+    baskets = [(k, [UserRequirements(pid, f'batch {(k + pid) % (args.baskets // 2 + 1)}')
+                    for pid in range(1, args.products + 1)]) for k in range(args.baskets)]
+    _, batch_peak, _ = measure('batch', lambda: list(BatchOptimizer().run(baskets)))
+    server.shutdown()
+
+    failed = False
+    for name, peak, ceiling in (('search', search_peak, args.search_ceiling), ('batch', batch_peak, args.batch_ceiling)):
+        if peak > ceiling:
+            print(f'{name} exceeded memory ceiling: {peak:.1f} MB > {ceiling} MB')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+from settings import *
+from cache import normalize_query
+from contextlib import closing
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    id INTEGER PRIMARY KEY,
+    query TEXT NOT NULL,
+    max_offers INTEGER NOT NULL,
+    max_stores INTEGER NOT NULL,
+    scraped_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS overviews (
+    id INTEGER PRIMARY KEY,
+    search_id INTEGER NOT NULL REFERENCES searches(id),
+    position INTEGER NOT NULL,
+    name TEXT,
+    min_price REAL,
+    link TEXT
+);
+CREATE TABLE IF NOT EXISTS offers (
+    id INTEGER PRIMARY KEY,
+    search_id INTEGER NOT NULL REFERENCES searches(id),
+    overview_id INTEGER REFERENCES overviews(id),
+    query TEXT NOT NULL,
+    store_id TEXT NOT NULL,
+    name TEXT,
+    price REAL NOT NULL,
+    delivery_costs TEXT NOT NULL,
+    rating REAL,
+    rating_count INTEGER,
+    link TEXT,
+    shop_name TEXT,
+    scraped_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS searches_query_idx ON searches(query, scraped_at);
+CREATE INDEX IF NOT EXISTS offers_search_idx ON offers(search_id);
+CREATE INDEX IF NOT EXISTS offers_query_idx ON offers(query, scraped_at);
+CREATE INDEX IF NOT EXISTS offers_store_idx ON offers(store_id, scraped_at);
+"""
+
+
+class OfferStore:
+    """
+    Persistent store of scrapped offers (SQLite): normalized query -> products overview -> offers.
+    Every scraping is saved as a new search, so the store keeps price history of the offers.
+    Offers are read only if they are fresh enough (max_age).
+    """
+
+    def __init__(self, path=OFFER_STORE_PATH, max_age=OFFER_STORE_MAX_AGE):
+        """
+        :param path:        (str)   : path of the database file
+        :param max_age:     (float) : max age of offers (in seconds) that can be returned by load()
+        """
+        self.path = path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.initialized = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=REQUEST_TIMEOUT)
+        if not self.initialized:        # create tables when the store is used for the first time
+            with self.lock:
+                connection.executescript(SCHEMA)
+                self.initialized = True
+        return connection
+
+    def save(self, query, products_overview, products, max_offers, max_stores):
+        """
+        Saves one scraping of the query.
+        :param query:               (str)           : product name
+        :param products_overview:   (list<dict>)    : overviews of SkapiecScraper
+        :param products:            (list<Product>) : scrapped offers
+        :param max_offers:          (int)           : number of overviews that have been scrapped
+        :param max_stores:          (int)           : number of stores scrapped on every DetailedSite
+        :return:
+        """
+        query = normalize_query(query)
+        scraped_at = time.time()
+        with closing(self.connect()) as connection, connection:
+            search_id = connection.execute(
+                'INSERT INTO searches (query, max_offers, max_stores, scraped_at) VALUES (?, ?, ?, ?)',
+                (query, max_offers, max_stores, scraped_at)).lastrowid
+
+            overview_ids = {}       # map {position: overview id}
+            for position, overview in enumerate(products_overview):
+                overview_ids[position] = connection.execute(
+                    'INSERT INTO overviews (search_id, position, name, min_price, link) VALUES (?, ?, ?, ?, ?)',
+                    (search_id, position, overview['name'], overview['min_price'], overview['link'])).lastrowid
+
+            connection.executemany(
+                'INSERT INTO offers (search_id, overview_id, query, store_id, name, price, delivery_costs, rating, '
+                'rating_count, link, shop_name, scraped_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(search_id, overview_ids.get(p.overview_idx), query, p.store_id, p.name, p.price,
+                  json.dumps(p.delivery_costs), p.rating, p.rating_count, p.link, p.shop_name, scraped_at)
+                 for p in products])
+        logging.info(f'[OfferStore] saved {len(products)} offers of "{query}"')
+
+    def load(self, query, max_offers=MAX_OFFERS, max_stores=MAX_STORES):
+        """
+        Returns offers of the latest fresh search of the query that has been scrapped with at least
+        given number of overviews and stores.
+        :param query:       (str)   : product name
+        :param max_offers:  (int)   :
+        :param max_stores:  (int)   :
+        :return:            (list)  : list of offers (dicts with Product arguments), None if there is no fresh search
+        """
+        query = normalize_query(query)
+        with closing(self.connect()) as connection:
+            row = connection.execute(
+                'SELECT id FROM searches WHERE query = ? AND scraped_at > ? AND max_offers >= ? AND max_stores >= ? '
+                'ORDER BY scraped_at DESC LIMIT 1',
+                (query, time.time() - self.max_age, max_offers, max_stores)).fetchone()
+            if row is None:
+                return None
+
+            rows = connection.execute(
+                'SELECT o.name, o.price, o.delivery_costs, o.rating, o.rating_count, o.link, o.shop_name, v.position '
+                'FROM offers o LEFT JOIN overviews v ON o.overview_id = v.id WHERE o.search_id = ?',
+                (row[0],)).fetchall()
+
+        return [{'name': name, 'price': price, 'delivery_costs': json.loads(delivery_costs), 'rating': rating,
+                 'rating_count': rating_count, 'link': link, 'shop_name': shop_name, 'overview_idx': position}
+                for name, price, delivery_costs, rating, rating_count, link, shop_name, position in rows]
+
+    def price_history(self, query, store_id=None):
+        """
+        Returns history of the cheapest price (without delivery) of the query, optionally in one store.
+        :param query:       (str)   : product name
+        :param store_id:    (str)   : id of the store, None means all stores
+        :return:            (list)  : list of tuples (scraped_at, store_id, price)
+        """
+        query = normalize_query(query)
+        sql = 'SELECT scraped_at, store_id, MIN(price) FROM offers WHERE query = ?'
+        params = [query]
+        if store_id is not None:
+            sql += ' AND store_id = ?'
+            params.append(store_id)
+        sql += ' GROUP BY scraped_at, store_id ORDER BY scraped_at'
+        with closing(self.connect()) as connection:
+            return connection.execute(sql, params).fetchall()
@@ -0,0 +1,122 @@
+"""
+Local relevance scoring of search results. Skapiec returns accessories and other models together with the
+searched product (e.g. "kabel do monitora LG" for "monitor 24 lg"), so products overview is ranked before
+offers pages are requested and only relevant products are scrapped.
+Score of the name is the fraction of query tokens found in it (numbers must be equal, words may differ
+by inflection) mixed with character trigram similarity of the whole strings. Names with a preposition
+before the query ("uchwyt do monitora") and products much cheaper than the typical relevant product
+are treated as accessories.
+"""
+from settings import *
+import logging
+import re
+import statistics
+import unicodedata
+
+TOKEN = re.compile(r'[a-z]+|\d+')
+POLISH_LETTERS = str.maketrans('ł', 'l')       # the only polish letter without decomposition
+TOKEN_WEIGHT = 0.8      # weight of token recall, the rest is trigram similarity
+ACCESSORY_WORDS = {'do', 'dla', 'for'}      # "kabel do monitora" is not a monitor
+ACCESSORY_PENALTY = 0.5
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text.lower().translate(POLISH_LETTERS))
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase words and numbers without diacritics, "24MK430H" gives ['24', 'mk', '430', 'h'].
+    """
+    return TOKEN.findall(normalize(text))
+
+
+def trigrams(text):
+    text = f' {text} '
+    return {text[k:k + 3] for k in range(len(text) - 2)}
+
+
+def similarity(a, b):
+    """ Jaccard similarity of character trigrams """
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb) if ta and tb else 0
+
+
+def common_prefix(a, b):
+    return next((k for k, (ca, cb) in enumerate(zip(a, b)) if ca != cb), min(len(a), len(b)))
+
+
+def token_matches(query_token, name_tokens):
+    """
+    :param name_tokens: (iterable)  : tokens of the name
+    """
+    if query_token.isdigit():
+        return query_token in name_tokens
+    for token in name_tokens:
+        if token == query_token:
+            return True
+        if common_prefix(token, query_token) >= max(4, min(len(token), len(query_token)) - 2):
+            return True     # inflection, e.g. monitor - monitora, lodówka - lodówki
+        if len(query_token) >= 4 and similarity(token, query_token) >= 0.6:
+            return True
+    return False
+
+
+def score(query, name):
+    """
+    :return:    (float) : relevance of the name to the query in range <0, 1>
+    """
+    query_tokens, name_tokens = tokenize(query), tokenize(name)
+    if not query_tokens:
+        return 1
+    recall = sum(token_matches(token, name_tokens) for token in query_tokens) / len(query_tokens)
+    result = TOKEN_WEIGHT * recall + (1 - TOKEN_WEIGHT) * similarity(' '.join(query_tokens), ' '.join(name_tokens))
+    return result * ACCESSORY_PENALTY if is_accessory(query_tokens, name_tokens) else result
+
+
+def is_accessory(query_tokens, name_tokens):
+    """
+    Name is an accessory if a preposition stands before the first word of the query, e.g. "uchwyt do monitora".
+    """
+    for token in name_tokens:
+        if token in ACCESSORY_WORDS:
+            return True
+        if any(token_matches(query_token, (token,)) for query_token in query_tokens):
+            return False
+    return False
+
+
+def rank_overviews(query, overviews, min_score=RELEVANCE_MIN_SCORE, price_ratio=RELEVANCE_PRICE_RATIO):
+    """
+    Ranks products overview by relevance to the query. Products with score below min_score and products
+    cheaper than price_ratio * median price of relevant products are cut. If nothing is relevant,
+    the order of the site is kept (the query might be written differently than names of products).
+    :param query:       (str)   : searched query
+    :param overviews:   (list)  : products overview, dicts {'name', 'min_price', 'link'}
+    :return:            (list)  : indexes of relevant overviews, the most relevant first
+    """
+    scores = [score(query, overview['name']) for overview in overviews]
+    relevant = [k for k, s in enumerate(scores) if s >= min_score]
+    if not relevant:
+        return list(range(len(overviews)))
+
+    if len(relevant) >= 3:
+        median_price = statistics.median(overviews[k]['min_price'] for k in relevant)
+        relevant = [k for k in relevant if overviews[k]['min_price'] >= price_ratio * median_price]
+
+    relevant.sort(key=lambda k: (-round(scores[k], 1), k))     # similar scores keep order of the site (price)
+    if len(relevant) < len(overviews):
+        logging.info(f'[RELEVANCE] "{query}": {len(overviews) - len(relevant)} of {len(overviews)} product(s) cut')
+    return relevant
+
+
+if __name__ == '__main__':
+    examples = [{'name': 'Kabel HDMI do monitora LG 1,5 m', 'min_price': 19.99},
+                {'name': 'Monitor LG 24MK430H-B', 'min_price': 499.0},
+                {'name': 'Uchwyt ścienny do monitora 24"', 'min_price': 59.0},
+                {'name': 'Monitor LG 27UL500-W', 'min_price': 899.0},
+                {'name': 'LG 24GN600-B', 'min_price': 749.0},
+                {'name': 'Monitor Samsung 24" S24R350', 'min_price': 479.0}]
+    for k in rank_overviews('monitor 24 lg', examples):
+        print(f'{score("monitor 24 lg", examples[k]["name"]):.2f}  {examples[k]["name"]}')
@@ -1,23 +1,50 @@
-from flask import Flask, render_template, url_for, flash, redirect, request
+from flask import Flask, render_template, url_for, flash, redirect, request, jsonify, Response, stream_with_context, \
+    session
 from forms import ProductForm
 from main3 import *
+from batch import BatchOptimizer
+from skyline import pareto_baskets
+import json
+import uuid
+import snapshot
+import threading
+import tracing
+from werkzeug.serving import is_running_from_reloader
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'd74d200efebb8016d462d9127428d243'
 so = SkapiecOptimizer()
+baskets = TTLCache(BASKET_TTL, MAX_BASKETS)     # map {tenant: SkapiecOptimizer with basket of the user}
+baskets_lock = threading.Lock()
+batch_optimizer = BatchOptimizer()
+
+
+def user_basket():
+    """
+    Returns optimizer with basket of the current user (session), caches and prefetches are shared by all users.
+    :return:    (SkapiecOptimizer)  :
+    """
+    tenant = session.setdefault('tenant', uuid.uuid4().hex)
+    with baskets_lock:
+        optimizer = baskets.get(tenant)
+        if optimizer is None:
+            optimizer = so.new_basket()
+        baskets.put(tenant, optimizer)      # every request of the user extends the expiration
+    return optimizer
 
 
 @app.route("/", methods=['GET', 'POST'])     # main page (i.e. root page)
 def home():
     form = ProductForm()
+    optimizer = user_basket()
     if form.validate_on_submit():
 
 
-        if so.add_product(form.name.data, form.count.data, form.min_price.data,
+        if optimizer.add_product(form.name.data, form.count.data, form.min_price.data,
                           form.max_price.data, form.min_rating.data, form.nrates.data):
             flash('Produkt dodany pomyślnie!', 'success')
         else:
-            flash('Nie możesz dodać więcej niż 5 produktów', 'danger')
+            flash(f'Nie możesz dodać więcej niż {MAX_BASKET_PRODUCTS} produktów', 'danger')
         return redirect(url_for('home'))
 
     form.count.data = DEFAULT_COUNT
@@ -25,38 +52,136 @@ def home():
     form.max_price.data = DEFAULT_MAX_PRICE
     form.min_rating.data = DEFAULT_RATING
     form.nrates.data = DEFAULT_MIN_NRATES
-    return render_template('home.html', form=form, products=so.in_products)
+    return render_template('home.html', form=form, products=optimizer.in_products)
 
 
 @app.route("/new-search", methods=['GET', 'POST'])     # main page (i.e. root page)
 def new_search():
-    so.clear_products()
+    user_basket().clear_products()
     return redirect(url_for('home'))
 
 
 @app.route('/search', methods=['POST'])
 def search():
-    if not so.in_products:
+    return run_search(refresh=False)
+
+
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    return run_search(refresh=True)     # scrap offers again, do not use cached ones
+
+
+@app.route('/pareto', methods=['POST'])
+def pareto():
+    return run_search(refresh=False, pareto=True)      # the cheapest basket of every store rating
+
+
+def run_search(refresh, pareto=False):
+    optimizer = user_basket()
+    if not optimizer.in_products:
         flash('Najpierw dodaj produkty', 'warning')
         return redirect(url_for('home'))
 
-    so.search()
-    results, msgs = so.find_best()
+    trace = TRACING_ENABLED or request.args.get('trace') == '1'
+    if request.args.get('profile') == '1':      # run one search under cProfile
+        (results, msgs, ctx), path = tracing.profiled('search', search_and_find, optimizer, refresh, trace, pareto)
+        flash(f'Profil zapisany w {path}', 'info')
+    else:
+        results, msgs, ctx = search_and_find(optimizer, refresh, trace, pareto)
     for msg in msgs:
         flash(msg, 'warning')
 
-    return render_template('results2.html', results=results)       # render results template
+    if pareto:
+        return render_template('results2.html', results=[basket.result_set for basket in results],
+                               ratings=[basket.rating for basket in results], partial=ctx.partial)
+    return render_template('results2.html', results=results, partial=ctx.partial)       # render results template
+
+
+def search_and_find(optimizer, refresh, trace=False, pareto=False):
+    """
+    :param optimizer:   (SkapiecOptimizer)  : optimizer with basket of the user (see user_basket)
+    :return:            (tuple)             : results, messages and SearchContext of this request
+                                              (optimizer is shared by requests of the user)
+    """
+    find = pareto_baskets if pareto else optimizer.find_best
+    tenant = session['tenant']      # searches of one user share one share of the site
+    if not trace:
+        user_reqs, ctx = optimizer.search(refresh=refresh, tenant=tenant)
+        return find(user_reqs, ctx) + (ctx,)
+
+    with tracing.trace('request', products=len(optimizer.in_products), refresh=refresh) as search_trace:
+        user_reqs, ctx = optimizer.search(refresh=refresh, tenant=tenant)
+        results = find(user_reqs, ctx) + (ctx,)
+    flash(f'Trace: {url_for("get_trace", trace_id=search_trace.id)}', 'info')
+    return results
+
+
+@app.route('/traces', methods=['GET'])
+def traces():
+    return jsonify([{'id': t.id, 'name': t.root.name, 'start': t.root.start, 'duration': t.root.duration()}
+                    for t in tracing.TRACES])
+
+
+@app.route('/traces/<int:trace_id>', methods=['GET'])
+def get_trace(trace_id):
+    """
+    Returns trace as JSON tree, ?format=chrome returns Chrome trace format.
+    """
+    search_trace = tracing.get_trace(trace_id)
+    if search_trace is None:
+        return jsonify({'error': 'trace not found'}), 404
+    if request.args.get('format') == 'chrome':
+        return jsonify(search_trace.to_chrome())
+    return jsonify(search_trace.to_dict())
 
 
 @app.route('/delete/<int:pid>', methods=['GET', 'POST'])
 def delete_product(pid):
-    if so.remove_product(pid):
+    if user_basket().remove_product(pid):
         flash('Produkt został wycofany', 'success')
     else:
         flash('Wystąpił błąd', 'danger')
     return redirect(url_for('home'))
 
 
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    """
+    Optimizes many baskets, results are streamed as JSON lines (one line per basket).
+    """
+    try:
+        baskets = BatchOptimizer.parse_baskets(request.get_json(silent=True))
+    except InvalidBasketException as e:
+        return jsonify({'error': str(e)}), 400
+
+    lines = (json.dumps(result, ensure_ascii=False) + '\n' for result in batch_optimizer.run(baskets))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'request_flights': REQUEST_FLIGHTS.stats(),
+        'query_flights': QUERY_FLIGHTS.stats(),
+        'offers_cache': so.offers_cache.stats(),
+        'delivery_pages': delivery_stats(),
+        'negative_cache': NEGATIVE_CACHE.stats(),
+        'search_cache': SEARCH_CACHE.stats(),
+        'delivery_cache': DELIVERY_CACHE.stats(),
+        'hedging': HEDGER.stats(),
+        'scheduler': SCHEDULER.stats() if SCHEDULER else None,
+    })
+
+
+@app.route('/history', methods=['GET'])
+def history():
+    query = request.args.get('q', '')
+    if not OFFER_STORE or not query:
+        return jsonify([])
+    return jsonify([{'scraped_at': scraped_at, 'store_id': store_id, 'price': price}
+                    for scraped_at, store_id, price in OFFER_STORE.price_history(query, request.args.get('store'))])
+
+
 def result_reformat(results):
     results_ = []
     for offers in results:
@@ -65,5 +190,16 @@ def result_reformat(results):
             print(product)
 
 
+def start_snapshot():
+    """
+    Starts loading and writing the cache snapshot, called when the server starts, not at import.
+    :return:    (SnapshotWriter)    : None if snapshots are disabled
+    """
+    if SNAPSHOT_ENABLED:
+        return snapshot.start(so)
+
+
 if __name__=="__main__":
+    if is_running_from_reloader():      # debug reloader's parent process only watches files, it serves nothing
+        start_snapshot()
     app.run(debug=True)
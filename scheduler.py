@@ -0,0 +1,185 @@
+"""
+Weighted fair queueing of http requests of concurrent searches. Number of requests sent to the site at
+the same time is limited by slots. When all slots are busy, requests wait in queues of their tenants
+(search, session or batch job) and a free slot is given to the request with the lowest virtual finish time,
+so a tenant with weight w gets w shares of slots no matter how many requests it has queued. Search pages
+are served before other pages, because offers and delivery pages of the search can not start without them.
+"""
+from settings import *
+import collections
+import heapq
+import itertools
+import math
+import threading
+import time
+
+PRIORITIES = {'search': 0}      # lower is served first, other page types have priority 1
+
+
+class Ticket:
+    """ Request waiting for a slot """
+
+    def __init__(self, tenant, kind, start, finish):
+        self.tenant = tenant
+        self.kind = kind
+        self.start = start              # virtual start time
+        self.finish = finish            # virtual finish time
+        self.created = time.time()
+        self.event = threading.Event()  # set when the slot is given
+        self.cancelled = False
+
+
+class TenantStats:
+
+    def __init__(self, window=SCHEDULER_WINDOW):
+        self.queued = 0             # requests waiting now
+        self.max_queued = 0
+        self.served = 0
+        self.timed_out = 0          # requests that had not got a slot before the deadline of the search
+        self.waits = collections.deque(maxlen=window)   # recent waiting times in seconds
+        self.last_finish = 0        # virtual finish time of the last queued request
+        self.last_active = time.time()
+
+    def to_dict(self):
+        waits = sorted(self.waits)
+        p95 = waits[max(0, math.ceil(0.95 * len(waits)) - 1)] if waits else 0
+        return {'queued': self.queued, 'max_queued': self.max_queued, 'served': self.served,
+                'timed_out': self.timed_out, 'wait_avg': round(sum(waits) / len(waits), 4) if waits else 0,
+                'wait_p95': round(p95, 4)}
+
+
+class FairScheduler:
+    """
+    Gives slots of http requests to tenants by weighted fair queueing, see the module docstring.
+    """
+
+    def __init__(self, slots=SCHEDULER_SLOTS, max_tenants=SCHEDULER_MAX_TENANTS):
+        """
+        :param slots:       (int)   : max number of requests sent at the same time
+        :param max_tenants: (int)   : idle tenants over this number are forgotten
+        """
+        self.free = slots
+        self.slots = slots
+        self.max_tenants = max_tenants
+        self.heap = []              # heap of tuples (priority, virtual finish time, sequence number, Ticket)
+        self.seq = itertools.count()
+        self.vtime = 0              # virtual time, finish time of the last served request
+        self.tenants = {}           # map {tenant: TenantStats}
+        self.lock = threading.Lock()
+
+    def acquire(self, tenant, kind, weight=1, timeout=None):
+        """
+        Waits for a slot.
+        :param tenant:  (str)   : search, session or batch job the request belongs to
+        :param kind:    (str)   : page type, see PRIORITIES
+        :param weight:  (float) : share of the tenant
+        :param timeout: (float) : max waiting time in seconds, None means no limit
+        :return:        (boolean)   : False if slot has not been given on time, release must not be called then
+        """
+        with self.lock:
+            stats = self.tenant(tenant)
+            stats.last_active = time.time()
+            if self.free > 0 and not self.heap:
+                self.free -= 1
+                stats.served += 1
+                stats.waits.append(0)
+                return True
+            start = max(self.vtime, stats.last_finish)
+            stats.last_finish = start + 1 / weight
+            ticket = Ticket(tenant, kind, start, stats.last_finish)
+            heapq.heappush(self.heap, (PRIORITIES.get(kind, 1), ticket.finish, next(self.seq), ticket))
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+
+        if ticket.event.wait(timeout):
+            return True
+        with self.lock:
+            if ticket.event.is_set():       # slot has been given in the meantime
+                return True
+            ticket.cancelled = True
+            stats.queued -= 1
+            stats.timed_out += 1
+            return False
+
+    def release(self):
+        """ Gives the slot to the next request or frees it """
+        with self.lock:
+            while self.heap:
+                ticket = heapq.heappop(self.heap)[-1]
+                if ticket.cancelled:
+                    continue
+                self.vtime = max(self.vtime, ticket.start)
+                stats = self.tenants[ticket.tenant]
+                stats.queued -= 1
+                stats.served += 1
+                stats.waits.append(time.time() - ticket.created)
+                ticket.event.set()
+                return
+            self.free += 1
+
+    def tenant(self, tenant):
+        stats = self.tenants.get(tenant)
+        if stats is None:
+            if len(self.tenants) >= self.max_tenants:
+                self.forget_idle()
+            stats = self.tenants[tenant] = TenantStats()
+        return stats
+
+    def forget_idle(self):
+        idle = sorted((stats.last_active, tenant) for tenant, stats in self.tenants.items() if not stats.queued)
+        for _, tenant in idle[:len(self.tenants) - self.max_tenants + 1]:
+            del self.tenants[tenant]
+
+    def stats(self):
+        with self.lock:
+            return {'slots': self.slots, 'busy': self.slots - self.free,
+                    'queued': sum(stats.queued for stats in self.tenants.values()),
+                    'tenants': {tenant: stats.to_dict() for tenant, stats in self.tenants.items()}}
+
+
+class HedgedSlots:
+    """
+    Slots of one hedged request (see hedging.py). The first http request uses the slot acquired by the caller,
+    duplicates wait for their own slots. Every slot is released when its http request ends, not when the caller
+    stops waiting, so late and duplicated requests are counted as long as they are sent.
+    """
+
+    def __init__(self, scheduler, tenant, kind, weight, end_time):
+        """
+        :param scheduler:   (FairScheduler) : scheduler that has given the slot to the caller
+        :param end_time:    (float)         : deadline of the request, duplicates do not wait for slots longer
+        """
+        self.scheduler = scheduler
+        self.tenant = tenant
+        self.kind = kind
+        self.weight = weight
+        self.end_time = end_time
+        self.state = 'given'        # 'given' - slot of the caller is not used yet, 'used', 'closed'
+        self.lock = threading.Lock()
+
+    def wrap(self, fn):
+        """
+        :param fn:  (callable)  : function that sends one http request
+        :return:    (callable)  : fn that holds a slot while it runs, it returns None if no slot was given on time
+        """
+        def send(*args):
+            with self.lock:
+                owned = self.state == 'given'
+                if owned:
+                    self.state = 'used'
+            if not owned and not self.scheduler.acquire(self.tenant, self.kind, self.weight,
+                                                        max(0, self.end_time - time.time())):
+                return None
+            try:
+                return fn(*args)
+            finally:
+                self.scheduler.release()
+        return send
+
+    def close(self):
+        """ Releases the slot of the caller if no request has used it (request dropped before it was sent) """
+        with self.lock:
+            unused = self.state == 'given'
+            self.state = 'closed'
+        if unused:
+            self.scheduler.release()
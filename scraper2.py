@@ -1,12 +1,19 @@
 from requests import get
 from requests.exceptions import RequestException
 from contextlib import closing
-from bs4 import BeautifulSoup, FeatureNotFound
+from collections import namedtuple
+import threading
 from settings import *
 import logging
 from exceptions import *
+from cache import TTLCache, NegativeCache, normalize_query, normalize_url
+from singleflight import SingleFlight
+from hedging import Hedger, deadline
+from scheduler import FairScheduler, HedgedSlots
+import tracing
 import ast
 import re
+import time
 
 
 """
@@ -46,23 +53,219 @@ and maybe other modules...
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 
 ID_COUNTER = 1
+_id_lock = threading.Lock()
+REQUEST_FLIGHTS = SingleFlight('request')       # concurrent requests to the same url share one response
+DELIVERY_FLIGHTS = SingleFlight('delivery')     # the same for streamed delivery pages
+NEGATIVE_CACHE = NegativeCache(NEGATIVE_CACHE_TTL, NEGATIVE_CACHE_SIZE)
+HEDGER = Hedger()
+SCHEDULER = FairScheduler() if SCHEDULER_ENABLED else None     # shares requests among concurrent searches
+SEARCH_CACHE = TTLCache(OFFERS_CACHE_TTL, SEARCH_CACHE_SIZE)          # map {normalized query: products overview}
+DELIVERY_CACHE = TTLCache(DELIVERY_CACHE_TTL, DELIVERY_CACHE_SIZE)    # map {normalized delivery url: delivery prices}
+_delivery_lock = threading.Lock()
+DELIVERY_STATS = {'pages': 0, 'aborted': 0, 'bytes': 0, 'parse_time': 0.0}
+SEARCH_PAGE_CLASSES = [NO_RESULTS_CLASS, PRODUCT_CLASS, PRODUCT_CLASS_ALT]  # parsed parts
+StoreRow = namedtuple('StoreRow', 'href name store_name price rating_avg rating_count free_delivery delivery_url')
+
+
+def next_product_id():
+    """
+    Returns unique product id, ids have to be unique among all scrapers working at the same time.
+    :return:    (int)
+    """
+    global ID_COUNTER
+    with _id_lock:
+        pid = ID_COUNTER
+        ID_COUNTER += 1
+    return pid
+
+
+def get_request(url, ctx=None, kind='page'):
+    """
+    Simple http get method, if error occurs or search deadline is exceeded it returns None
+    :param url:
+    :param ctx:     (SearchContext) : context of the search, it limits the request timeout
+    :param kind:    (str)           : page type, it selects request deadline (see REQUEST_DEADLINES)
+    :return:        (bytes)         : raw html content of the requested site
+    """
+    if ctx and ctx.expired():
+        ctx.mark_partial(f'request to {url} skipped')
+        return None
+    with tracing.span('http', url=url):
+        content = REQUEST_FLIGHTS.do(normalize_url(url), scheduled, kind, ctx, fetch, url,
+                                     timeout=flight_timeout(kind, ctx), shared=shared_result(ctx))
+    if content is None:
+        mark_failed_request(url, ctx)
+    return content
+
 
-def get_request(url):
+def get_delivery_rulesets(url, ctx=None):
     """
-    Simple http get method, if error occurs it returns None
+    Streaming version of get_request for delivery pages. Page is parsed while it is downloaded
+    and the connection is closed as soon as delivery table (or proof that it is missing) is found.
     :param url:
-    :return:    (bytes)   : raw html content of the requested site
+    :param ctx:     (SearchContext) : context of the search, it limits the request timeout
+    :return:        (DeliveryRulesetsParser)    : parser with extracted data, None if error occurs
     """
+    if ctx and ctx.expired():
+        ctx.mark_partial(f'request to {url} skipped')
+        return None
+    with tracing.span('http_stream', url=url):
+        rulesets = DELIVERY_FLIGHTS.do(normalize_url(url), scheduled, 'delivery', ctx, fetch_delivery_rulesets, url,
+                                       timeout=flight_timeout('delivery', ctx), shared=shared_result(ctx))
+    if rulesets is None:
+        mark_failed_request(url, ctx)
+    return rulesets
+
+
+def scheduled(kind, ctx, fn, url):
+    """
+    Sends the request (hedged, see hedging.py) when SCHEDULER gives a slot to the tenant of the search.
+    Request deadline is counted from the moment the slot is given, waiting for it is limited by the deadline
+    of the search or by SCHEDULER_MAX_WAIT. Slots are held until http requests end (see HedgedSlots),
+    so duplicates and requests abandoned on deadline are counted too.
+    :param fn:  (callable)  : fetch or fetch_delivery_rulesets
+    :return:                : result of fn, None if slot has not been given on time
+    """
+    budget = ctx.budget if ctx else None
+    if SCHEDULER is None:
+        timeout = deadline(kind, ctx)
+        return HEDGER.run(kind, timeout, fn, url, timeout, budget)
+    tenant, weight = (ctx.tenant, ctx.weight) if ctx else ('default', 1)
+    if not SCHEDULER.acquire(tenant, kind, weight, ctx.remaining() if ctx else SCHEDULER_MAX_WAIT):
+        logging.warning(f'[SCHEDULER] no free slot for {url} before the deadline')
+        return None
+    timeout = deadline(kind, ctx)
+    slots = HedgedSlots(SCHEDULER, tenant, kind, weight, time.time() + timeout)
     try:
-        with closing(get(url, stream=True)) as resp:
-            if is_good_response(resp):
-                return resp.content
-            else:
+        return HEDGER.run(kind, timeout, slots.wrap(fn), url, timeout, budget) if timeout > 0 else None
+    finally:
+        slots.close()
+
+
+def flight_timeout(kind, ctx):
+    """
+    Max time of waiting for the same request sent by another search, it includes waiting for a slot.
+    """
+    if SCHEDULER is None:
+        return deadline(kind, ctx)
+    if ctx and ctx.remaining() is not None:
+        return ctx.remaining()
+    return SCHEDULER_MAX_WAIT + deadline(kind, ctx)
+
+
+def shared_result(ctx):
+    """
+    Returns predicate of SingleFlight.do. Failed request is not shared with other searches if it may have
+    failed because of the context of the search (deadline, cancelled prefetch, exhausted request budget).
+    """
+    def shared(result):
+        return result is not None or not (ctx and (ctx.expired() or (ctx.budget and ctx.budget.exhausted())))
+    return shared
+
+
+def make_soup(page, name=None, **attrs):
+    """
+    Parses html page, bs4 and lxml are imported on the first use, because they slow down startup of the app.
+    If name or attributes are given, only matching elements (with their content) are parsed, the rest of
+    the page is skipped, so the tree is much smaller.
+    :param page:    (str)   : html content
+    :param name:    (str)   : tag name of parsed elements
+    :param attrs:           : attributes of parsed elements, as in BeautifulSoup.find_all
+    :return:        (BeautifulSoup)
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+    parse_only = SoupStrainer(name, **attrs) if name or attrs else None
+    return BeautifulSoup(page, 'lxml', parse_only=parse_only)
+
+
+def mark_failed_request(url, ctx):
+    if ctx and ctx.expired():
+        ctx.mark_partial(f'request to {url} timed out')
+    elif ctx and ctx.budget and ctx.budget.exhausted():
+        ctx.mark_partial(f'request to {url} skipped, request budget exhausted')
+
+
+def fetch(url, timeout=REQUEST_TIMEOUT, budget=None):
+    """
+    Sends http get request, it should not be called directly (see get_request).
+    :param url:
+    :param timeout: (float)         : timeout of the whole request, the download is dropped when it is exceeded
+    :param budget:  (RequestBudget) : request is not sent if budget is exhausted
+    :return:        (bytes)         : raw html content of the requested site, None if error occurs
+    """
+    if budget and not budget.acquire():
+        return None
+    end_time = time.time() + timeout
+    try:
+        with closing(get(url, stream=True, timeout=timeout)) as resp:
+            if not is_good_response(resp):
+                return None
+            chunks = []
+            for chunk in resp.iter_content(FETCH_CHUNK_SIZE):
+                if time.time() > end_time:
+                    log_error(f'[get request] {url} has not been downloaded in {timeout:.2f}s')
+                    return None
+                chunks.append(chunk)
+            return b''.join(chunks)
+
+    except RequestException as e:
+        log_error(f'[get request] Error during requests to {url} : {str(e)}')
+        return None
+
+
+def fetch_delivery_rulesets(url, timeout=REQUEST_TIMEOUT, budget=None):
+    """
+    Sends http get request and feeds DeliveryRulesetsParser with chunks of the response until it has all the data,
+    it should not be called directly (see get_delivery_rulesets).
+    :return:        (DeliveryRulesetsParser)    : None if error occurs
+    """
+    from lxml import etree
+    if budget and not budget.acquire():
+        return None
+    parser = None
+    received, parse_time = 0, 0.0
+    end_time = time.time() + timeout
+    try:
+        with closing(get(url, stream=True, timeout=timeout)) as resp:
+            if not is_good_response(resp):
                 return None
+            parser = DeliveryRulesetsParser(response_charset(resp))
+            for chunk in resp.iter_content(DELIVERY_CHUNK_SIZE):
+                if time.time() > end_time:
+                    log_error(f'[get request] {url} has not been downloaded in {timeout:.2f}s')
+                    return None
+                received += len(chunk)
+                start = time.perf_counter()
+                done = parser.feed(chunk)
+                parse_time += time.perf_counter() - start
+                if done:
+                    break       # closing the response drops the rest of the page
+            else:
+                parser.close()
+        return parser
 
     except RequestException as e:
         log_error(f'[get request] Error during requests to {url} : {str(e)}')
         return None
+    except etree.LxmlError as e:
+        log_error(f'[get request] Error during parsing {url} : {str(e)}')
+        return None
+    finally:
+        with _delivery_lock:
+            DELIVERY_STATS['pages'] += 1
+            DELIVERY_STATS['aborted'] += bool(parser and parser.aborted)
+            DELIVERY_STATS['bytes'] += received
+            DELIVERY_STATS['parse_time'] += parse_time
+
+
+def delivery_stats():
+    with _delivery_lock:
+        return dict(DELIVERY_STATS)
+
+
+def response_charset(resp):
+    match = re.search(r'charset=([\w-]+)', resp.headers.get('Content-Type', ''), re.IGNORECASE)
+    return match.group(1) if match else DELIVERY_ENCODING
 
 
 def is_good_response(resp):
@@ -79,6 +282,122 @@ def log_error(e):
     logging.error(str(e))
 
 
+class DeliveryRulesetsParser:
+    """
+    Incremental parser of delivery details page. It is fed with chunks of the page and reports when
+    all needed data is known: table of delivery prices has been closed or content of the page has ended
+    without the table (table is the part of div#product_content).
+    Elements are cleared as soon as they are parsed, so the tree of the page is never kept in memory.
+    """
+
+    def __init__(self, encoding=DELIVERY_ENCODING):
+        from lxml import etree
+        self.parser = etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+        self.content = None
+        self.table = None
+        self.prices = None      # texts of prices from the table, None if page has no delivery table
+        self.done = False
+        self.aborted = False    # True if the rest of the page has not been read
+
+    @property
+    def has_content(self):
+        """ False if the page has no delivery information at all """
+        return self.content is not None
+
+    def feed(self, chunk):
+        """
+        :param chunk:   (bytes)     : next part of the page
+        :return:        (boolean)   : True if all needed data has been found and the rest of the page can be skipped
+        """
+        self.parser.feed(chunk)
+        self.read_events()
+        self.aborted = self.done
+        return self.done
+
+    def close(self):
+        """ Called after the whole page has been fed """
+        self.parser.close()
+        self.read_events()
+        self.done = True
+
+    def read_events(self):
+        for event, elem in self.parser.read_events():
+            if event == 'start':
+                self.start(elem)
+            elif self.end(elem):
+                self.done = True
+                return
+
+    def start(self, elem):
+        if elem.tag == 'div' and self.content is None and elem.get('id') == DELIVERY_CONTENT_ID:
+            self.content = elem
+        elif elem.tag == 'table' and self.table is None and elem.get('id') == DELIVERY_TABLE_ID:
+            self.table = elem
+            self.prices = []
+
+    def end(self, elem):
+        if elem is self.table or elem is self.content:
+            return True
+        if elem.tag == 'b' and self.table is not None:
+            self.prices.append(''.join(elem.itertext()))
+        elem.clear()
+        return False
+
+
+# do not look through every page when there is no information about delivery (check that!)
+@tracing.traced('get_delivery_price')
+def scrap_delivery_prices(delivery_url, ctx=None):  # iterate through delivery options url 1-5
+    """
+    Gets all the possible delivery costs. If prices are not specified, returns empty list.
+    If delivery is free 0.00 price is added to the returned list.
+    :param delivery_url:    (str)           : url of delivery details site
+    :param ctx:             (SearchContext) : context of the search
+    :return:                (list<float>)   : list of all the delivery prices
+    """
+    prices_list = []
+    key = normalize_url(URL + delivery_url)
+    if NEGATIVE_CACHE.check('delivery', key):
+        logging.info(f'[get_delivery_prices]: delivery is not specified (negative cache), url={delivery_url}')
+        return prices_list
+    cached = DELIVERY_CACHE.get(key)
+    if cached:
+        return list(cached)
+
+    requests, failed = 0, False
+    for k in range(1, DELIVERY_METHODS + 1):
+        if k == 3 or k == 4:          # personal pickup - ignore that case
+            continue
+        d_url = delivery_url + f"&t={k}"
+        d_url = URL + d_url
+        rulesets = get_delivery_rulesets(d_url, ctx)
+        requests += 1
+        if rulesets:
+            if not rulesets.has_content:            # no delivery information at all
+                break
+
+            if rulesets.prices is None:             # no table with all the prices
+                logging.error('no delivery options')
+                continue
+
+            for text in rulesets.prices:
+                price = text.strip()
+                pattern = r"od.*\s*.*do"
+                if re.match(pattern, price):        # price might be ~ "od x zł do y zł"
+                    p = re.compile(r"od\s+(\d+\.\d+).*\s*do")   # pattern for minimum price
+                    price = p.search(price).group(1)
+                    prices_list.append(float(price))
+                else:
+                    prices_list.append(float(text.replace('zł', '').strip()))
+        else:
+            failed = True
+            logging.info('[get_delivery_prices]: no page returned, url={}'.format(d_url))
+    if not prices_list and not failed:      # all pages returned, none of them has prices
+        NEGATIVE_CACHE.add('delivery', key, requests)
+    elif prices_list and not failed:
+        DELIVERY_CACHE.put(key, list(prices_list))
+    return prices_list
+
+
 class DetailedSite:
     """
     This class is a representation of a site which contains a list of stores that sell one product.
@@ -86,34 +405,72 @@ class DetailedSite:
     Due to possibility of choosing number of stores to be scrapped you can control how many http requests you want to make.
     """
 
-    def __init__(self, url, pid):
+    def __init__(self, url, pid, ctx=None):
         """
-        :param url:     (str)   : url of skapiec page with stores from which we can buy product
+        :param url:     (str)           : url of skapiec page with stores from which we can buy product
+        :param ctx:     (SearchContext) : context of the search
         """
         self.url = url
         self.page = ""
-        self.stores_boxes = []
+        self.stores = []        # list of StoreRow (None if the row could not be parsed)
         self.pid = pid
+        self.ctx = ctx
 
         self.get_page()
         self.extract_stores()
 
     def get_page(self):
-        self.page = get_request(self.url)
+        if NEGATIVE_CACHE.check('offers', normalize_url(self.url)):
+            logging.info(f'[get_page] page has no offers (negative cache), url={self.url}')
+            self.page = ""
+            return
+        self.page = get_request(self.url, self.ctx, 'offers')
 
+    @tracing.traced('parse')
     def extract_stores(self):
         """
-        Finds all html contents that contain all information about offer.
-        Saves it in class variable self.stores_boxes.
+        Extracts plain information about every offer and saves it in class variable self.stores.
+        Page and its parse tree are freed right after that, only compact rows are kept while stores are scrapped.
         :return:
         """
+        if not self.page:       # request failed or was skipped (deadline, cancelled search)
+            logging.info(f'[extract_stores] no page returned, url={self.url}')
+            return
+        soup = None
         try:
-            soup = BeautifulSoup(self.page, 'lxml')
+            soup = make_soup(self.page, 'a', class_=PRODUCT_CLASS_D)
             # self.full_name = soup.find('div', class_='header-content').h1.text
-            self.stores_boxes = soup.find_all('a', class_=PRODUCT_CLASS_D)
-            logging.info('[extract_stores] found %s store(s)', len(self.stores_boxes))
+            self.stores = [self.extract_store(box) for box in soup.find_all('a', class_=PRODUCT_CLASS_D)]
+            logging.info('[extract_stores] found %s store(s)', len(self.stores))
+            if not self.stores:
+                NEGATIVE_CACHE.add('offers', normalize_url(self.url))
         except Exception as e:
             logging.error('[extract_stores] error while parsing page: {}'.format(str(e)))
+        finally:
+            self.page = ""
+            if soup is not None:
+                soup.decompose()        # tree has reference cycles, without it memory waits for gc
+
+    def extract_store(self, box):
+        """
+        Extracts plain values of one offer from html content.
+        :param box:     (Tag)       : html content that contains information about offer
+        :return:        (StoreRow)  : None if the offer can not be parsed
+        """
+        try:
+            free_delivery = box.find('span', class_=FREE_DELIVERY_CLASS) is not None
+            delivery_url = None
+            if not free_delivery:
+                delivery_url = str(box.find('a', class_=DELIVERY_LINK_CLASS)['href'])
+            name = box.find('span', class_=OFFER_NAME_CLASS).text
+            price = float(
+                box.find('span', class_=OFFER_PRICE_CLASS).text.replace("zł", "").replace(",", ".").replace(" ", ""))
+            rating_avg, rating_count = self.get_rating(box)
+            return StoreRow(str(box['href']), name[:60], self.get_store_name(box), price, rating_avg, rating_count,
+                            free_delivery, delivery_url)
+        except Exception as e:
+            logging.error('[extract_store] error while extracting offer: {}'.format(str(e)))
+            return None
 
     def scrap_all_stores(self):
         """
@@ -121,76 +478,75 @@ class DetailedSite:
         :return:    (List<Product>) : list of scrapped products
         """
         products = []
-        for k in range(len(self.stores_boxes)):
+        for k in range(len(self.stores)):
             p = self.scrap_store(k)
             if p:
                 products.append(p)
         return products
 
-    def scrap_nstores(self, n, start=0):
+    def scrap_nstores(self, n, start=0, allow=None):
         """
-        Scrap N stores by starting from [start] index in self.stores_boxes.
-        If start+N exceeds length of self.stores_boxes, result will be cut.
-        If start exceeds length of self.stores_boxes, empty list will be returned.
-        :param start:   (int)           : start index of self.stores_boxes
+        Scrap N stores by starting from [start] index in self.stores.
+        If start+N exceeds length of self.stores, result will be cut.
+        If start exceeds length of self.stores, empty list will be returned.
+        :param start:   (int)           : start index of self.stores
         :param n:       (int)           : amount of stores to be scrapped
+        :param allow:   (callable)      : allow(row) returns False if the row should be skipped (see BudgetPlanner)
         :return:        (List<Product>) : list of scrapped products
         """
         products = []
         end = start + n
-        end = min(len(self.stores_boxes), end)
+        end = min(len(self.stores), end)
 
         for k in range(start, end):
+            if self.ctx and self.ctx.expired():
+                self.ctx.mark_partial(f'stores {k}-{end} of {self.url} not scrapped')
+                break
+            if allow and self.stores[k] and not allow(self.stores[k]):
+                continue
             p = self.scrap_store(k)
             if p:
                 products.append(p)
         logging.info(f'[scrap_nstores] returned {len(products)} products')
         return products
 
+    @tracing.traced('scrap_store')
     def scrap_store(self, num):
         """
         Scraps all necessary information about product's offer from one store.
         :param num:     (int)       : index of store which information will be scrapped
         :return:        (Product)   : scrapped product, None if delivery is not specified
         """
-        if -1 < num < len(self.stores_boxes):
-            pbox = self.stores_boxes[num]
+        if -1 < num < len(self.stores):
+            row = self.stores[num]
         else:
-            logging.error('[scrap_store]: {num} is greater than self.stores_boxes length')
+            logging.error(f'[scrap_store]: {num} is greater than self.stores length')
+            return None
+        if row is None:         # error has been logged by extract_store
             return None
         try:
             # firstly check deliveries, if there no information about delivery price - skip that product
-            delivery_prices = self.get_deliveries(pbox)
+            delivery_prices = self.get_deliveries(row)
             if not delivery_prices:
                 logging.info('[scrap_store] delivery is not specified')
                 return None
 
-            href = pbox['href']
-            name = pbox.find('span', class_='description gtm_or_name').text
-            shop_link = URL + href
-            store_name = self.get_store_name(pbox)
-            rating_avg, rating_count = self.get_rating(pbox)
-
-            base_price = float(
-                pbox.find('span', class_="price gtm_or_price").text.replace("zł", "").replace(",", ".").replace(" ", ""))
-
-            return Product(self.pid, name[:60], base_price, delivery_prices, rating_avg, rating_count, shop_link, store_name)
+            shop_link = URL + row.href
+            return Product(self.pid, row.name, row.price, delivery_prices, row.rating_avg, row.rating_count,
+                           shop_link, row.store_name)
         except Exception as e:
             logging.error('[scrap store] error while scrapping store: {}'.format(str(e)))
 
-    def get_deliveries(self, box):
+    def get_deliveries(self, row):
         """
-        Finds html tag that holds information about deliveries, if delivery is free then returns one-element list,
-         otherwise calls proper method to scrap all delivery possibilities.
-        :param box:     (str)   : html content that contains information about order
-        :return:        (List)  : list of delivery prices
+        If delivery is free then returns one-element list, otherwise calls proper method to scrap
+        all delivery possibilities.
+        :param row:     (StoreRow)  : offer extracted from the page
+        :return:        (List)      : list of delivery prices
         """
-        if box.find('span', class_="delivery-cost free-delivery badge gtm_bdg_fd"):  # free delivery
-            delivery_prices = [0.00]
-        else:
-            delivery_url = box.find('a', class_="delivery-cost link gtm_oa_shipping")['href']
-            delivery_prices = self.get_delivery_price(delivery_url)
-        return delivery_prices
+        if row.free_delivery:
+            return [0.00]
+        return self.get_delivery_price(row.delivery_url)
 
     def get_store_name(self, box):
         """
@@ -198,7 +554,7 @@ class DetailedSite:
         :param box: (str)   : html content that should contains information about store name
         :return:    (str)   : store name
         """
-        shop_name_tag = box.find('img', class_='offer-dealer-logo gtm_bdg_l')
+        shop_name_tag = box.find('img', class_=OFFER_STORE_CLASS)
         if not shop_name_tag:
             shop_name = box.find('b', class_='offer-dealer-logo').text.strip()
 
@@ -215,7 +571,7 @@ class DetailedSite:
         rating_avg = 0
         rating_count = 0
 
-        div_rating = box.find('div', class_="shop-rating gtm_stars")
+        div_rating = box.find('div', class_=OFFER_RATING_CLASS)
 
         # some stores do not have rating
         if div_rating:
@@ -226,44 +582,13 @@ class DetailedSite:
 
         return rating_avg, rating_count
 
-    # do not look through every page when there is no information about delivery (check that!)
-    def get_delivery_price(self, delivery_url):  # iterate through delivery options url 1-5
+    def get_delivery_price(self, delivery_url):
         """
-        Gets all the possible delivery costs. If prices are not specified, returns empty list.
-        If delivery is free 0.00 price is added to the returned list.
+        Gets all the possible delivery costs of the offer (see scrap_delivery_prices).
         :param delivery_url:    (str)           : url of delivery details site
         :return:                (list<float>)   : list of all the delivery prices
         """
-        prices_list = []
-
-        for k in range(1, DELIVERY_METHODS + 1):
-            if k == 3 or k == 4:          # personal pickup - ignore that case
-                continue
-            d_url = delivery_url + f"&t={k}"
-            d_url = URL + d_url
-            page = get_request(d_url)
-            if page:
-                soup = BeautifulSoup(page, 'lxml')
-                if not soup.find('div', id="product_content"):          # no delivery information at all
-                    break
-
-                prices = soup.find('table', id='deliveryRulesets')      # find table with all the prices
-                if not prices:
-                    logging.error('no delivery options')
-                    continue
-
-                for b in prices.find_all('b'):
-                    price = b.text.strip()
-                    pattern = r"od.*\s*.*do"
-                    if re.match(pattern, price):        # price might be ~ "od x zł do y zł"
-                        p = re.compile(r"od\s+(\d+\.\d+).*\s*do")   # pattern for minimum price
-                        price = p.search(price).group(1)
-                        prices_list.append(float(price))
-                    else:
-                        prices_list.append(float(b.text.replace('zł', '').strip()))
-            else:
-                logging.info('[get_delivery_prices]: no page returned, url={}'.format(d_url))
-        return prices_list
+        return scrap_delivery_prices(delivery_url, self.ctx)
 
 
 class SkapiecScraper:
@@ -275,47 +600,73 @@ class SkapiecScraper:
 
     def __init__(self, pid=0):
         self.base_url = URL
+        self.page = ""
+        self.soup = None        # parse tree of the page, it is freed as soon as products overview is extracted
         self.products_boxes = []
         self.products_overview = []
         self.pid = pid
+        self.ctx = None
+        self.not_found = False  # True if the site has answered that there is no such product
 
-    def load_page(self, product_name):
+    @tracing.traced('load_page')
+    def load_page(self, product_name, ctx=None):
         """
         Loads page and saves its html.
-        :param product_name:    (str)   : name of desired product
-        :return:                (bool)  : True if the page is loaded successfully, else False
+        :param product_name:    (str)           : name of desired product
+        :param ctx:             (SearchContext) : context of the search
+        :return:                (bool)          : True if the page is loaded successfully, else False,
+                                                  not_found tells if the product does not exist or request has failed
         """
         logging.info('scraper started')
         self.clear()
+        self.ctx = ctx
+        self.not_found = False
+        query = normalize_query(product_name)
+        if NEGATIVE_CACHE.check('query', query):
+            logging.info(f'[load_page] product "{product_name}" not found (negative cache)')
+            self.not_found = True
+            return False
         product_name = product_name.strip().replace(" ", "+")
-        url = f"https://www.skapiec.pl/szukaj/w_calym_serwisie/{product_name}/price/"       # /price/ means sort asc
-        self.pid += 1       # new product new id
+        url = f"{self.base_url}/szukaj/w_calym_serwisie/{product_name}/price/"       # /price/ means sort asc
+        self.pid = next_product_id()       # new product new id
+        cached = SEARCH_CACHE.get(query)
+        if cached:
+            logging.info(f'[load_page] products overview of "{query}" loaded from cache')
+            self.products_overview = list(cached)
+            return True
         try:
-            self.page = self.get_page(url)      # get html content
+            self.page = self.get_page(url, ctx)      # get html content
             self.load_products()                # scrap html divs that contains all necessary information
             if self.products_boxes:
                 self.load_products_info()           # extract information from divs (boxes)
+                SEARCH_CACHE.put(query, list(self.products_overview))
                 return True
             else:
                 return False
 
         except ProductNotFoundException:
+            NEGATIVE_CACHE.add('query', query)
+            self.not_found = True
             return False
         except LoadingProductException:
             return False
         except ProductOverviewException:
             return False
+        finally:
+            self.release_page()
 
+    @tracing.traced('parse')
     def load_products(self):
         """
         Loads html divs that hold all the information about the product.
         :return:    (None)
         """
         try:
-            soup = BeautifulSoup(self.page, 'lxml')
+            soup = self.soup if self.soup is not None else make_soup(self.page, class_=SEARCH_PAGE_CLASSES)
+            self.soup = soup
             self.products_boxes = soup.find_all(class_=PRODUCT_CLASS)
             if not self.products_boxes:
-                self.products_boxes = soup.find_all(class_="box-row js add-to-compare")
+                self.products_boxes = soup.find_all(class_=PRODUCT_CLASS_ALT)
 
             logging.info('[load_products] found %s products', len(self.products_boxes))
 
@@ -331,8 +682,8 @@ class SkapiecScraper:
         """
         for product in self.products_boxes:
             try:
-                name = product.find('h2', class_="title gtm_red_solink").text.strip()
-                price = product.find('strong', class_="price gtm_sor_price").text
+                name = product.find('h2', class_=PRODUCT_NAME_CLASS).text.strip()
+                price = product.find('strong', class_=PRODUCT_PRICE_CLASS).text
                 price = float(price.replace("zł", "").replace(",", ".").replace(" ", "").replace("od", ""))
                 href = product.find('a', href=True)['href']
                 url_stores = self.base_url + href  # create full url link to detailed site
@@ -344,15 +695,17 @@ class SkapiecScraper:
                 raise ProductOverviewException()
 
     # new version <------------------------------------------------------------------------------------
+    @tracing.traced('load_product_stores')
     def load_product_stores(self, num):
         """
         Returns an object that provides method to scrap offers of the product.
+        DetailedSite shares the search context passed to load_page.
         :param num:     (int)   : index of products_overview from which method gets link
         :return:        (obj)   : instance of DetailedSite
         """
         if -1 < num < len(self.products_overview):
             url = self.products_overview[num]['link']
-            return DetailedSite(url, self.pid)
+            return DetailedSite(url, self.pid, self.ctx)
         else:
             logging.error(f'[scrap_product] wrong argument passed to the function: {num}')
             raise OutOfBoundException()
@@ -377,28 +730,34 @@ class SkapiecScraper:
         return products
     # --------------------------------------------------------------------------------------------------
 
-    def get_page(self, url):
+    def get_page(self, url, ctx=None):
         """
         Gets the page html content. If searching is unsuccessful then returns empty string.
-        :param url:     (str)   : url of the site to scrap
-        :return:        (str)   : html content of page. If site returns an error, returns empty string.
+        :param url:     (str)           : url of the site to scrap
+        :param ctx:     (SearchContext) : context of the search
+        :return:        (str)           : html content of page. If site returns an error, returns empty string.
         """
-        page = get_request(url)
+        page = get_request(url, ctx, 'search')
+        if page is None:        # request has failed, it does not mean that the product does not exist
+            return ""
 
         if self.is_found(page):
             return page
         else:
             return ""
 
+    @tracing.traced('parse')
     def is_found(self, page):
         """
         Checks whether the system found desired product or not.
         :param page:    (str)   : html content of the page
         :return:        (bool)  : True if page has been found, else False
         """
+        from bs4 import FeatureNotFound
+        soup = None
         try:
-            soup = BeautifulSoup(page, 'lxml')
-            msg_div = soup.find(class_="message only-header info")
+            soup = make_soup(page, class_=SEARCH_PAGE_CLASSES)
+            msg_div = soup.find(class_=NO_RESULTS_CLASS)
 
             if msg_div:
                 content = msg_div.find(class_="content")
@@ -407,13 +766,17 @@ class SkapiecScraper:
                 logging.warning(f"[is_found] page returned msg: {content.text}")
                 raise ProductNotFoundException()
             else:
+                self.soup, soup = soup, None        # parse tree is reused by load_products
                 return True
 
         except FeatureNotFound as e:
             logging.error(f'[is_found] probably you need to install lxml:  {e}')
-            raise ProductNotFoundException()
+            raise LoadingProductException()
         except TypeError as e:
             logging.error(f'[is_found] probably empty page was passed:  {e}')
+        finally:
+            if soup is not None:
+                soup.decompose()
 
     def get_products_overview(self):
         return self.products_overview
@@ -430,9 +793,20 @@ class SkapiecScraper:
         Clear class variables, it is called before loading new page.
         :return:
         """
-        self.products_boxes = []
+        self.release_page()
         self.products_overview = []
 
+    def release_page(self):
+        """
+        Frees the page and its parse tree, only products overview (plain values) is kept.
+        :return:
+        """
+        if self.soup is not None:
+            self.soup.decompose()       # tree has reference cycles, without it memory waits for gc
+        self.soup = None
+        self.page = ""
+        self.products_boxes = []
+
 
 class Product:
 
@@ -461,6 +835,7 @@ class Product:
         self.total_max_price = self.price + max(self.delivery_costs)
         self.in_id = None
         self.count = 0
+        self.overview_idx = None    # index of products overview the offer comes from
 
     def __str__(self):
         pid = '{:<12}  {:<12}\n'.format("Name: ", self.pid)
@@ -478,6 +853,11 @@ class Product:
         return f"({self.name}, {self.price}, {self.delivery_costs}, {self.rating}, {self.rating_count}," \
             f" sid: {self.store_id}, min_total: {self.total_min_price})"
 
+    def to_dict(self):
+        return {'name': self.name, 'price': self.price, 'count': self.count, 'delivery_costs': self.delivery_costs,
+                'rating': self.rating, 'rating_count': self.rating_count, 'link': self.link,
+                'store_id': self.store_id, 'shop_name': self.shop_name}
+
 if __name__ == "__main__":
     """
     Usage:
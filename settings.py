@@ -1,5 +1,7 @@
+import os
+
 # SCRAPER SETTINGS
-URL = "https://www.skapiec.pl"
+URL = os.environ.get('SKAPIEC_URL', "https://www.skapiec.pl")     # e.g. local fake site (see fake_skapiec.py)
 NO_RESULTS_STR = "Brak produktów dla wyszukiwanej frazy."
 LOGGING_FILE = 'scraper.log'
 
@@ -9,10 +11,29 @@ PRODUCT_CLASS = "box-row js"
 PRODUCT_WRAPPER_CLASS_D = "js page prices"
 PRODUCT_CLASS_D = "offer-row-item gtm_or_row"
 
+# parts of the pages read by the scraper (fake_skapiec.py generates pages with the same ones)
+NO_RESULTS_CLASS = "message only-header info"
+PRODUCT_CLASS_ALT = "box-row js add-to-compare"     # product box of some search pages
+PRODUCT_NAME_CLASS = "title gtm_red_solink"
+PRODUCT_PRICE_CLASS = "price gtm_sor_price"
+OFFER_NAME_CLASS = "description gtm_or_name"
+OFFER_PRICE_CLASS = "price gtm_or_price"
+OFFER_STORE_CLASS = "offer-dealer-logo gtm_bdg_l"   # image, its alt is the store name
+OFFER_RATING_CLASS = "shop-rating gtm_stars"
+FREE_DELIVERY_CLASS = "delivery-cost free-delivery badge gtm_bdg_fd"
+DELIVERY_LINK_CLASS = "delivery-cost link gtm_oa_shipping"
+DELIVERY_CONTENT_ID = "product_content"
+DELIVERY_TABLE_ID = "deliveryRulesets"
+
 DELIVERY_METHODS = 5
+DELIVERY_CHUNK_SIZE = 4096       # delivery pages are parsed while downloading (see DeliveryRulesetsParser)
+FETCH_CHUNK_SIZE = 16384         # other pages are downloaded in chunks, so the request deadline is kept
+DELIVERY_ENCODING = 'utf-8'     # used if delivery page response does not specify charset
 
 # CONSTANTS
-MAX_TIME = 15
+MAX_TIME = 15               # deadline of the whole search in seconds
+FIND_TIME_RESERVE = 3       # part of MAX_TIME reserved for the algorithm
+REQUEST_TIMEOUT = 10        # timeout of one http request
 MAX_PAGES = 3
 RETURNED_SETS = 3
 
@@ -20,6 +41,79 @@ RETURNED_SETS = 3
 MAX_STORES = 10
 MAX_OFFERS = 5
 
+# basket size
+MAX_BASKET_PRODUCTS = 50
+BASKET_TTL = 24 * 60 * 60       # basket of the web app user is dropped after a day without requests
+MAX_BASKETS = 10000             # baskets of the least recently active users are dropped first
+LARGE_BASKET_THRESHOLD = 5      # bigger baskets are solved by LargeBasketSolver
+LARGE_BASKET_MAX_OFFERS = 2     # MAX_OFFERS used for big baskets
+LARGE_BASKET_MAX_STORES = 5     # MAX_STORES used for big baskets
+SEARCH_WORKERS = 8              # number of basket products scrapped at the same time
+OFFERS_CACHE_TTL = 15 * 60      # seconds, scrapped offers are reused by next searches
+DELIVERY_CACHE_TTL = 60 * 60    # seconds, delivery costs of offers are reused by next searches
+OFFERS_CACHE_SIZE = 500         # max number of cached offer lists (the least recently used are evicted)
+SEARCH_CACHE_SIZE = 2000        # max number of cached products overviews
+DELIVERY_CACHE_SIZE = 50000     # max number of cached delivery costs
+NEGATIVE_CACHE_SIZE = 50000     # max number of cached negative results
+CACHE_SWEEP_INTERVAL = 60       # seconds, expired entries of caches are removed at most this often
+PREFETCH_ENABLED = True         # start scraping when product is added to the basket
+PREFETCH_WORKERS = 4
+PREFETCH_MAX_TIME = 60          # deadline of one prefetch in seconds
+OFFER_STORE_ENABLED = True      # save scrapped offers in SQLite database and read fresh ones
+OFFER_STORE_PATH = 'offers.db'
+OFFER_STORE_MAX_AGE = 60 * 60   # seconds, older offers are scrapped again
+BATCH_FIND_WORKERS = 4          # number of baskets optimized at the same time by batch API
+BATCH_QUERY_MAX_TIME = 60       # deadline of scraping one query in batch mode
+SOLVER_TIME_BUDGET = 5          # seconds, limited by time left to the deadline
+SKYLINE_TIME_BUDGET = 10        # seconds of all the algorithm runs of price vs rating search (see skyline.py)
+NEGATIVE_CACHE_TTL = 30 * 60    # seconds, not found products and offers without delivery are not scrapped again, 0 disables
+SEARCH_REQUEST_BUDGET = None    # max http requests of one search handed out by BudgetPlanner (e.g. 150), None disables
+PLANNER_ROW_REQUESTS = 2        # expected requests of one store row (delivery pages), used to plan offers pages
+
+# warm-start snapshot of caches (see snapshot.py)
+SNAPSHOT_ENABLED = True
+SNAPSHOT_PATH = 'snapshot.json.gz'
+SNAPSHOT_INTERVAL = 5 * 60      # seconds between snapshots, the last one is written at exit
+SNAPSHOT_MAX_ENTRIES = 500      # max number of entries of one cache, the most used are kept
+
+# relevance ranking of search results (see relevance.py)
+RELEVANCE_ENABLED = True        # offers pages are requested only for products relevant to the query
+RELEVANCE_MIN_SCORE = 0.5       # products with lower score are not scrapped
+RELEVANCE_PRICE_RATIO = 0.25    # products cheaper than this fraction of median price are accessories
+
+# watch mode of saved baskets (see watch.py)
+WATCH_INTERVAL = 4 * 60 * 60    # seconds between refreshes of one basket
+WATCH_JITTER = 0.2              # fraction of the interval, refreshes are spread randomly to avoid bursts
+WATCH_THRESHOLD = 0.05          # best total that moved by more than this fraction is reported
+WATCH_DELIVERY_MAX_AGE = 24 * 60 * 60   # seconds, delivery costs of seen offers are reused by refreshes
+
+# distributed scraping workers (see workers.py)
+WORKER_QUEUE_PORT = 50505       # port of the work queue served by the coordinator
+WORKER_AUTHKEY = os.environ.get('SKAPIEC_WORKER_AUTHKEY')   # shared secret of coordinator and workers, no default
+WORKER_THREADS = 8              # tasks processed at the same time by one worker process
+
+# fair scheduling of requests of concurrent searches (see scheduler.py)
+SCHEDULER_ENABLED = True
+SCHEDULER_SLOTS = 16            # max number of requests sent to the site at the same time
+SCHEDULER_MAX_WAIT = 30         # seconds, max waiting for a slot of requests without search deadline
+SCHEDULER_WINDOW = 200          # number of recent waiting times of one tenant kept for stats
+SCHEDULER_MAX_TENANTS = 100     # idle tenants over this number are forgotten
+BACKGROUND_WEIGHT = 0.5         # share of prefetches and batch jobs, searches of users have weight 1
+
+# per-request deadlines and hedged requests (see hedging.py)
+REQUEST_DEADLINES = {'search': 10, 'offers': 8, 'delivery': 5}     # seconds, whole request of the page type
+HEDGE_ENABLED = True            # send duplicate of a late request
+HEDGE_PERCENTILE = 90           # request is late if it takes longer than this percentile of recent latencies
+HEDGE_MIN_SAMPLES = 20          # latencies needed before the first duplicate is sent
+HEDGE_WINDOW = 200              # number of recent latencies of one page type
+HEDGE_MAX_RATIO = 0.1           # max number of duplicates per request
+HEDGE_MAX_THREADS = 64          # max number of requests running at the same time, abandoned ones included
+
+# tracing and profiling (see tracing.py)
+TRACING_ENABLED = False         # trace every search, single search can be traced with /search?trace=1
+TRACE_HISTORY = 20              # number of finished traces kept in memory
+PROFILE_DIR = 'profiles'        # cProfile stats of /search?profile=1
+
 # default search parameters
 DEFAULT_COUNT = 1
 DEFAULT_MIN_PRICE = 0
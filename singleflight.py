@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+
+
+class Call:
+    """ One call in flight, shared by all the callers with the same key """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = True      # False if the result must not be given to waiting callers
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls with the same key: the first caller does the work, callers that come
+    while it is in flight wait for it and get the same result (or exception).
+    Result caused by the state of the first caller (e.g. None because its deadline has passed) is not shared,
+    the waiting callers then do the work themselves.
+    Results are not cached, the next call after the first one has finished does the work again.
+    """
+
+    def __init__(self, name):
+        """
+        :param name:    (str)   : name used in logs and stats
+        """
+        self.name = name
+        self.calls = {}         # map {key: Call}
+        self.lock = threading.Lock()
+        self.requests = 0       # all calls
+        self.saved = 0          # calls that shared result of another call
+        self.retried = 0        # calls that got not shared result and did the work themselves
+
+    def do(self, key, fn, *args, timeout=None, default=None, shared=None):
+        """
+        Calls fn(*args) unless call with the same key is in flight.
+        :param key:         (hashable)  : key of the call
+        :param fn:          (callable)  : function that does the work
+        :param timeout:     (float)     : max time of waiting for the call made by another caller
+        :param default:                 : returned if waiting has timed out
+        :param shared:      (callable)  : shared(result) is False if the result must not be given to waiting
+                                          callers, None means that every result is shared
+        :return:                        : result of fn
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        with self.lock:
+            self.requests += 1
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = Call()
+                    self.calls[key] = call
+
+            if leader:
+                break
+            logging.debug(f'[SingleFlight] {self.name}: waiting for call in flight, key={key}')
+            if not call.done.wait(None if end_time is None else max(0, end_time - time.time())):
+                return default
+            if call.error:
+                raise call.error
+            with self.lock:
+                if call.shared:
+                    self.saved += 1
+                    return call.result
+                self.retried += 1
+            logging.debug(f'[SingleFlight] {self.name}: result of the call is not shared, key={key}')
+
+        try:
+            call.result = fn(*args)
+            call.shared = shared is None or shared(call.result)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def stats(self):
+        return {'requests': self.requests, 'saved': self.saved, 'retried': self.retried, 'in_flight': len(self.calls)}
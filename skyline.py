@@ -0,0 +1,96 @@
+"""
+Pareto frontier of baskets on total price against seller reputation. Reputation of a basket is the lowest
+rating of its stores, so one search answers every min_rating at once: for every rating threshold the cheapest
+basket is found and baskets that are both more expensive and not better rated than another one are dropped.
+Thresholds are not tried one by one - the next threshold is the reputation of the last found basket, so the
+algorithm is run once per basket of the frontier (plus one run that finds no basket).
+"""
+from main3 import *
+import math
+
+
+class ParetoBasket:
+    """ Basket of the frontier: the cheapest one with its reputation """
+
+    def __init__(self, result_set, rating):
+        self.result_set = result_set
+        self.total_price = result_set.total_price
+        self.rating = rating        # the lowest rating of stores of the basket
+
+    def to_dict(self):
+        return dict(self.result_set.to_dict(), min_rating=self.rating)
+
+
+def real_products(result_set):
+    return [p for p in result_set.products if p is not None and p != NULL_PRODUCT]
+
+
+def basket_rating(result_set):
+    ratings = [p.rating for p in real_products(result_set)]
+    return min(ratings) if ratings else 0
+
+
+def skyline(baskets):
+    """
+    Sort-and-sweep skyline: after sorting by price, a basket is on the frontier if it is rated better
+    than every cheaper basket.
+    :param baskets: (list)  : list of ParetoBaskets
+    :return:        (list)  : Pareto-optimal baskets, the cheapest first
+    """
+    frontier, best_rating = [], -math.inf
+    for basket in sorted(baskets, key=lambda b: (b.total_price, -b.rating)):
+        if basket.rating > best_rating:
+            frontier.append(basket)
+            best_rating = basket.rating
+    return frontier
+
+
+def with_min_rating(user_req, min_rating):
+    user_req = copy.copy(user_req)      # found products are shared, only requirements are changed
+    user_req.min_rating = max(user_req.min_rating, min_rating)
+    return user_req
+
+
+def feasible(user_reqs):
+    """ True if every found product has an offer that meets requirements, False if no product has offers """
+    found = [user_req for user_req in user_reqs if user_req.found_products.products_list]
+    return bool(found) and all(any(user_req.accepts(p.price, p.rating, p.rating_count)
+                                   for p in user_req.found_products.products_list) for user_req in found)
+
+
+def pareto_baskets(user_reqs, ctx=None, time_budget=SKYLINE_TIME_BUDGET):
+    """
+    :param user_reqs:   (list)          : user requirements with found products, see SkapiecOptimizer.search
+    :param ctx:         (SearchContext) : context of the search, time left of its deadline caps time_budget
+    :param time_budget: (float)         : seconds of all the algorithm runs, large baskets are solved with a share of it
+    :return:            (tuple)         : list of ParetoBaskets (the cheapest first), list of messages of the first run
+    """
+    if ctx and ctx.find_remaining() is not None:
+        time_budget = min(time_budget, ctx.find_remaining())
+    end_time = time.time() + time_budget
+    search_partial = ctx is not None and ctx.partial
+    baskets, msgs = [], []
+    reqs = user_reqs        # the first run uses requirements of the user, it may ignore them like find_best
+    while True:
+        handler = AlgorithmHandler(reqs, max(0, (end_time - time.time()) / 4))
+        results = handler.find()
+        if not baskets:
+            msgs = handler.msgs
+        if not results or not real_products(results[0]):
+            break
+        rating = basket_rating(results[0])
+        if baskets and rating <= baskets[-1].rating:    # threshold has not risen, next runs would find the same
+            break
+        baskets.append(ParetoBasket(results[0], rating))
+        reqs = [with_min_rating(user_req, baskets[-1].rating) for user_req in user_reqs]   # rating > min_rating
+        if not feasible(reqs):
+            break
+        if time.time() >= end_time:
+            if ctx:
+                ctx.mark_partial('not all store ratings have been checked')
+            msgs.append('Wyniki częściowe: nie wszystkie progi oceny sklepów zostały sprawdzone w wymaganym czasie')
+            break
+    if search_partial:
+        msgs.append('Wyniki częściowe: nie wszystkie oferty zostały pobrane w wymaganym czasie')
+    logging.info(f'[SKYLINE] {len(baskets)} run(s) of the algorithm')
+    return skyline(baskets), msgs
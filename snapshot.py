@@ -0,0 +1,122 @@
+"""
+Warm-start snapshot of hot caches: offer lists of popular queries, search overviews, delivery costs
+and negative results. Snapshot is written on an interval and at exit (gzipped JSON, written to temporary file
+and renamed, so it is never broken) and loaded in the background at startup, so the app starts
+without waiting for it. Entries keep their expiration times, stale entries are not loaded.
+"""
+from main3 import *
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+SNAPSHOT_VERSION = 1
+
+
+def collect(optimizer, limit=SNAPSHOT_MAX_ENTRIES):
+    """
+    :param optimizer:   (SkapiecOptimizer)  : optimizer which offers cache is saved
+    :return:            (dict)              : JSON serializable snapshot
+    """
+    return {
+        'version': SNAPSHOT_VERSION,
+        'created': time.time(),
+        'offers': [[query, expires, plist.to_dict()]
+                   for query, expires, plist in optimizer.offers_cache.snapshot(limit)],
+        'overviews': SEARCH_CACHE.snapshot(limit),
+        'deliveries': DELIVERY_CACHE.snapshot(limit),
+        'negative': [[list(key), expires, requests] for key, expires, requests in NEGATIVE_CACHE.snapshot(limit)],
+    }
+
+
+def write(optimizer, path=SNAPSHOT_PATH):
+    start = time.time()
+    data = collect(optimizer)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    logging.info(f'[SNAPSHOT] {len(data["offers"])} offer list(s), {len(data["overviews"])} overview(s), '
+                 f'{len(data["deliveries"])} delivery cost(s) saved to {path} in {time.time() - start:.3f}s')
+
+
+def load(optimizer, path=SNAPSHOT_PATH):
+    """
+    Restores caches from the snapshot, entries cached in the meantime are not overwritten.
+    :return:    (int)   : number of restored entries
+    """
+    if not os.path.exists(path):
+        return 0
+    start = time.time()
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f'[SNAPSHOT] error while reading {path}: {e}')
+        return 0
+    if data.get('version') != SNAPSHOT_VERSION:
+        logging.warning(f'[SNAPSHOT] {path} has unsupported version {data.get("version")}, ignored')
+        return 0
+
+    restored = 0
+    for query, expires, plist in data['offers']:
+        restored += optimizer.offers_cache.restore(query, expires, ProductList.from_dict(plist))
+    for query, expires, overview in data['overviews']:
+        restored += SEARCH_CACHE.restore(query, expires, overview)
+    for url, expires, prices in data['deliveries']:
+        restored += DELIVERY_CACHE.restore(url, expires, prices)
+    for key, expires, requests in data['negative']:
+        restored += NEGATIVE_CACHE.restore(tuple(key), expires, requests)
+    logging.info(f'[SNAPSHOT] {restored} cache entries restored from {path} in {time.time() - start:.3f}s')
+    return restored
+
+
+class SnapshotWriter:
+    """
+    Loads snapshot in the background, then writes new one every SNAPSHOT_INTERVAL seconds and at exit.
+    Nothing is written before the old snapshot has been loaded, so quick restart does not lose it.
+    """
+
+    def __init__(self, optimizer, path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL):
+        self.optimizer = optimizer
+        self.path = path
+        self.interval = interval
+        self.loaded = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def run(self):
+        load(self.optimizer, self.path)
+        self.loaded.set()
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        if not self.stopped.is_set():
+            self.stopped.set()
+            self.write()
+
+    def write(self):
+        if not self.loaded.is_set():
+            return
+        try:
+            write(self.optimizer, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            logging.error(f'[SNAPSHOT] error while writing {self.path}: {e}')
+
+
+def start(optimizer, path=SNAPSHOT_PATH):
+    """
+    Starts loading the snapshot and writing new ones.
+    :return:    (SnapshotWriter)    :
+    """
+    writer = SnapshotWriter(optimizer, path)
+    writer.start()
+    return writer
@@ -0,0 +1,207 @@
+from settings import *
+from store_index import StoreIndex
+import logging
+import random
+import time
+
+
+class LargeBasketSolver:
+    """
+    Heuristic solver for big baskets (more than LARGE_BASKET_THRESHOLD products).
+    It starts from the cheapest offer of every product and then runs a local search over the stores:
+    - move one product to another offer,
+    - consolidate all products that one store can supply in that store (shared delivery).
+    Search stops when no move improves the basket or when time budget is exceeded.
+    Quality of the result is reported as a gap to the lower bound of the basket price.
+    """
+
+    def __init__(self, processed_products, time_budget=SOLVER_TIME_BUDGET, seed=0, store_index=None):
+        """
+        :param processed_products:  (list<list<Product>>)   : offers of every product (might be empty)
+        :param time_budget:         (float)                 : max time of the search in seconds
+        :param seed:                (int)                   : seed of perturbation moves
+        :param store_index:         (StoreIndex)            : index of processed_products, built if not given
+        """
+        if store_index is None:
+            store_index = StoreIndex()
+            for item, offers in enumerate(processed_products):
+                store_index.add_all(item, offers)
+        self.store_index = store_index
+        self.offers = [self.reduce(offers) for offers in processed_products]
+        self.time_budget = time_budget
+        self.random = random.Random(seed)
+        self.positions = [{offer.store_id: idx for idx, offer in enumerate(offers)}     # map {store_id: offer_idx}
+                          for offers in self.offers]
+        self.shared_stores = store_index.covering(2)
+
+        self.lower_bound = self.calculate_lower_bound()
+        self.best_price = None
+        self.gap = None
+        self.timed_out = False
+
+    @staticmethod
+    def reduce(offers):
+        """
+        Leave only the cheapest offer from every store.
+        :param offers:  (list<Product>) :
+        :return:        (list<Product>) : offers sorted by (price, -rating)
+        """
+        best = {}
+        for offer in offers:
+            current = best.get(offer.store_id)
+            if current is None or StoreIndex.offer_key(offer) < StoreIndex.offer_key(current):
+                best[offer.store_id] = offer
+        return sorted(best.values(), key=StoreIndex.offer_key)
+
+    def store_moves(self, store_id):
+        """
+        :return:    (dict)  : map {item: offer index} of all items supplied by the store
+        """
+        return {item: self.positions[item][store_id] for item in self.store_index.offers(store_id)}
+
+    def calculate_lower_bound(self):
+        """
+        Every product costs at least its cheapest price, and the store of at least one of them
+        charges for delivery at least the minimum delivery cost of the chosen offer.
+        :return:    (float) : lower bound of total price of the basket
+        """
+        cheapest = []
+        with_delivery = []
+        for offers in self.offers:
+            if not offers:
+                continue
+            cheapest.append(min(o.count * o.price for o in offers))
+            with_delivery.append(min(o.count * o.price + o.min_delivery for o in offers))
+
+        if not cheapest:
+            return 0
+        base = sum(cheapest)
+        return base + max(d - c for c, d in zip(cheapest, with_delivery))
+
+    def store_price(self, store_id, items, assignment):
+        """
+        Price of products bought in one store, computed the same way as ResultSet.calculate_total_price.
+        :param store_id:    (str)       :
+        :param items:       (iterable)  : indexes of products bought in the store
+        :param assignment:  (list)      : offer index of every product
+        :return:            (float)     :
+        """
+        items = list(items)
+        if not items:
+            return 0
+        offers = [self.offers[i][assignment[i]] for i in items]
+        price = sum(o.count * o.price for o in offers)
+        if len(offers) > 1:
+            price += max(o.max_delivery for o in offers)
+        else:
+            price += offers[0].min_delivery
+        return price
+
+    def total_price(self, assignment):
+        stores = self.group_by_store(assignment)
+        return sum(self.store_price(s, items, assignment) for s, items in stores.items())
+
+    def group_by_store(self, assignment):
+        stores = {}
+        for item, idx in enumerate(assignment):
+            if idx is not None:
+                stores.setdefault(self.offers[item][idx].store_id, set()).add(item)
+        return stores
+
+    def move_delta(self, stores, assignment, moves):
+        """
+        Returns difference of basket price after applying moves.
+        :param stores:      (dict)  : map {store_id: set of items}
+        :param assignment:  (list)  : current offer index of every product
+        :param moves:       (dict)  : map {item: new offer index}
+        :return:            (float) :
+        """
+        touched = set()
+        new_assignment = list(assignment)
+        for item, idx in moves.items():
+            touched.add(self.offers[item][assignment[item]].store_id)
+            touched.add(self.offers[item][idx].store_id)
+            new_assignment[item] = idx
+
+        old = sum(self.store_price(s, stores.get(s, ()), assignment) for s in touched)
+        new_stores = {s: set(stores.get(s, ())) for s in touched}
+        for item, idx in moves.items():
+            new_stores[self.offers[item][assignment[item]].store_id].discard(item)
+            new_stores[self.offers[item][idx].store_id].add(item)
+        new = sum(self.store_price(s, items, new_assignment) for s, items in new_stores.items())
+        return new - old
+
+    def candidate_moves(self, assignment):
+        """
+        Generates single reassignments and store consolidations.
+        """
+        for store_id in self.shared_stores:
+            moves = {item: idx for item, idx in self.store_moves(store_id).items() if assignment[item] != idx}
+            if moves:
+                yield moves
+
+        for item, offers in enumerate(self.offers):
+            for idx in range(len(offers)):
+                if assignment[item] is not None and idx != assignment[item]:
+                    yield {item: idx}
+
+    def local_search(self, assignment, end_time):
+        stores = self.group_by_store(assignment)
+        improved = True
+        while improved:
+            improved = False
+            for moves in self.candidate_moves(assignment):
+                if time.time() > end_time:
+                    self.timed_out = True
+                    return assignment
+                if self.move_delta(stores, assignment, moves) < -1e-9:
+                    for item, idx in moves.items():
+                        stores[self.offers[item][assignment[item]].store_id].discard(item)
+                        stores.setdefault(self.offers[item][idx].store_id, set()).add(item)
+                        assignment[item] = idx
+                    improved = True
+        return assignment
+
+    def perturb(self, assignment):
+        """
+        Consolidates products in randomly chosen store even if the basket gets more expensive.
+        """
+        new_assignment = list(assignment)
+        if not self.shared_stores:
+            return new_assignment
+        store_id = self.random.choice(self.shared_stores)
+        for item, idx in self.store_moves(store_id).items():
+            new_assignment[item] = idx
+        return new_assignment
+
+    def solve(self, nsets=RETURNED_SETS):
+        """
+        Main method of the class. Returns the best assignments found within time budget.
+        :param nsets:   (int)   : number of returned assignments
+        :return:        (list)  : list of lists of products (None if product has no offers),
+                                  sorted by total price
+        """
+        end_time = time.time() + self.time_budget
+        greedy = [0 if offers else None for offers in self.offers]
+        found = {tuple(greedy): self.total_price(greedy)}
+
+        assignment = self.local_search(list(greedy), end_time)
+        found[tuple(assignment)] = self.total_price(assignment)
+        stale = 0
+        while time.time() < end_time and not self.timed_out and stale < len(self.shared_stores):
+            candidate = self.local_search(self.perturb(min(found, key=found.get)), end_time)
+            key = tuple(candidate)
+            if key in found:
+                stale += 1      # perturbation leads back to known solution
+                continue
+            stale = 0
+            found[key] = self.total_price(candidate)
+
+        ranked = sorted(found, key=found.get)[:nsets]
+        self.best_price = found[ranked[0]]
+        self.gap = (self.best_price - self.lower_bound) / self.best_price if self.best_price else 0
+        logging.info(f'[SOLVE] best price: {self.best_price:.2f}, lower bound: {self.lower_bound:.2f}, '
+                     f'gap: {self.gap:.2%}, timed out: {self.timed_out}')
+
+        return [[self.offers[item][idx] if idx is not None else None for item, idx in enumerate(key)]
+                for key in ranked]
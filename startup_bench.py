@@ -0,0 +1,71 @@
+"""
+Measures startup of the web app: import of routes2 (app setup) in fresh interpreters, whether heavy parsing
+modules are imported at startup, and loading of the cache snapshot.
+
+Usage:
+python startup_bench.py --runs 10
+python startup_bench.py --snapshot snapshot.json.gz
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+IMPORT_APP = '''
+import json, sys, time
+start = time.perf_counter()
+import settings
+settings.SNAPSHOT_ENABLED = False       # do not write snapshot at exit of the benchmark
+import routes2
+print(json.dumps({'time': time.perf_counter() - start, 'bs4': 'bs4' in sys.modules, 'lxml': 'lxml' in sys.modules}))
+'''
+
+IMPORT_PARSERS = '''
+import json, time
+start = time.perf_counter()
+import bs4, lxml.etree
+print(json.dumps({'time': time.perf_counter() - start}))
+'''
+
+LOAD_SNAPSHOT = '''
+import json, sys, time
+import settings
+settings.SNAPSHOT_ENABLED = False
+import snapshot
+from main3 import SkapiecOptimizer
+optimizer = SkapiecOptimizer()
+optimizer.prefetch_executor.shutdown()
+start = time.perf_counter()
+restored = snapshot.load(optimizer, sys.argv[1])
+print(json.dumps({'time': time.perf_counter() - start, 'restored': restored}))
+'''
+
+
+def run(code, *args):
+    out = subprocess.run([sys.executable, '-c', code, *args], capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def measure(name, code, runs, *args):
+    results = [run(code, *args) for _ in range(runs)]
+    times = [r['time'] * 1000 for r in results]
+    print(f'{name:>16}: median {statistics.median(times):7.1f} ms, min {min(times):7.1f} ms, '
+          f'max {max(times):7.1f} ms  {({k: v for k, v in results[-1].items() if k != "time"})}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures startup time of the app.')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--snapshot', default=None, help='snapshot file to load')
+    args = parser.parse_args(argv)
+
+    measure('import routes2', IMPORT_APP, args.runs)
+    measure('import bs4, lxml', IMPORT_PARSERS, args.runs)
+    if args.snapshot:
+        measure('load snapshot', LOAD_SNAPSHOT, args.runs, args.snapshot)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
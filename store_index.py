@@ -0,0 +1,65 @@
+class StoreIndex:
+    """
+    Index of offers by store, maintained incrementally while offers are added:
+    - store_id -> best (cheapest) offer of every basket item the store supplies,
+    - number of items every store covers, grouped so stores that supply many items can be found
+      without scanning all the stores.
+    Items are identified by their index in the basket.
+    """
+
+    def __init__(self):
+        self.stores = {}        # map {store_id: {item: best offer}}
+        self.coverage = {}      # map {number of covered items: set of store ids}
+        self.best = {}          # map {item: best offer among all stores}
+
+    @staticmethod
+    def offer_key(product):
+        return product.price, -product.rating
+
+    def add(self, item, product):
+        """
+        Adds offer of the item. Only the best offer of the item in one store is kept.
+        :param item:        (int)       : index of the item in the basket
+        :param product:     (Product)   :
+        :return:
+        """
+        offers = self.stores.setdefault(product.store_id, {})
+        current = offers.get(item)
+        if current is None:
+            covered = len(offers)
+            if covered:
+                self.coverage[covered].discard(product.store_id)
+            self.coverage.setdefault(covered + 1, set()).add(product.store_id)
+        if current is None or self.offer_key(product) < self.offer_key(current):
+            offers[item] = product
+
+        best = self.best.get(item)
+        if best is None or self.offer_key(product) < self.offer_key(best):
+            self.best[item] = product
+
+    def add_all(self, item, products):
+        for product in products:
+            self.add(item, product)
+
+    def offers(self, store_id):
+        """
+        :param store_id:    (str)   :
+        :return:            (dict)  : map {item: best offer of the item in the store}
+        """
+        return self.stores.get(store_id, {})
+
+    def covered(self, store_id):
+        return len(self.stores.get(store_id, ()))
+
+    def covering(self, min_items=2):
+        """
+        Returns stores that supply at least min_items items of the basket.
+        :param min_items:   (int)   :
+        :return:            (list)  : list of store ids, stores covering more items first
+        """
+        stores = []
+        for covered in sorted(self.coverage, reverse=True):
+            if covered < min_items:
+                break
+            stores.extend(sorted(self.coverage[covered]))
+        return stores
@@ -0,0 +1,209 @@
+"""
+Opt-in tracing of single searches.
+Trace is a tree of spans (search -> item -> load_page -> load_product_stores -> scrap_store -> get_delivery_price
+-> http / parse). Spans are created with span() context manager, it does nothing if there is no active trace,
+so instrumented code costs almost nothing when tracing is off.
+Current span is kept per thread, functions run in other threads must be wrapped with wrap() to stay in the trace.
+Finished traces are kept in memory (TRACE_HISTORY) and can be exported as JSON tree or Chrome trace format
+(chrome://tracing, https://ui.perfetto.dev).
+profiled() runs one call under cProfile, wrapped functions run in other threads are profiled too and their
+stats are merged into one file.
+"""
+from settings import *
+from collections import deque
+from contextlib import contextmanager
+import cProfile
+import functools
+import itertools
+import logging
+import os
+import pstats
+import threading
+import time
+
+_local = threading.local()
+_trace_ids = itertools.count(1)
+TRACES = deque(maxlen=TRACE_HISTORY)    # finished traces, the newest last
+
+
+class Span:
+
+    def __init__(self, trace, name, parent=None, **attrs):
+        self.trace = trace
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.children = []
+        self.thread_id = threading.get_ident()
+        self.start = time.time()
+        self.end = None
+
+    def finish(self):
+        self.end = time.time()
+
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+    def to_dict(self):
+        with self.trace.lock:
+            children = list(self.children)
+        return {'name': self.name, 'start': self.start, 'duration': self.duration(), 'attrs': self.attrs,
+                'thread': self.thread_id, 'children': [child.to_dict() for child in children]}
+
+
+class Trace:
+
+    def __init__(self, name, **attrs):
+        self.id = next(_trace_ids)
+        self.lock = threading.Lock()
+        self.root = Span(self, name, **attrs)
+
+    def add_span(self, name, parent, **attrs):
+        span_ = Span(self, name, parent, **attrs)
+        with self.lock:
+            parent.children.append(span_)
+        return span_
+
+    def spans(self):
+        stack = [self.root]
+        while stack:
+            span_ = stack.pop()
+            yield span_
+            with self.lock:
+                stack.extend(span_.children)
+
+    def to_dict(self):
+        return {'id': self.id, 'root': self.root.to_dict()}
+
+    def to_chrome(self):
+        """
+        Returns trace in Chrome trace event format (complete events, microseconds).
+        """
+        events = [{'name': s.name, 'ph': 'X', 'ts': int((s.start - self.root.start) * 1e6),
+                   'dur': int(s.duration() * 1e6), 'pid': os.getpid(), 'tid': s.thread_id,
+                   'args': {k: str(v) for k, v in s.attrs.items()}}
+                  for s in self.spans()]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def current_span():
+    return getattr(_local, 'span', None)
+
+
+@contextmanager
+def trace(name, **attrs):
+    """
+    Starts a new trace, all the spans created in this thread (and in wrapped functions) belong to it.
+    """
+    previous = current_span()
+    new_trace = Trace(name, **attrs)
+    _local.span = new_trace.root
+    try:
+        yield new_trace
+    finally:
+        new_trace.root.finish()
+        _local.span = previous
+        TRACES.append(new_trace)
+        logging.info(f'[TRACE] trace {new_trace.id} finished in {new_trace.root.duration():.3f}s')
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Creates child of the current span, does nothing if tracing is not active.
+    """
+    parent = current_span()
+    if parent is None:
+        yield None
+        return
+    child = parent.trace.add_span(name, parent, **attrs)
+    _local.span = child
+    try:
+        yield child
+    finally:
+        child.finish()
+        _local.span = parent
+
+
+def traced(name):
+    """
+    Decorator that runs function in a new span.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def wrap(fn):
+    """
+    Returns function that runs fn in the current span (and profiling session), used to pass trace
+    to other threads.
+    """
+    parent = current_span()
+    session = getattr(_local, 'profile_session', None)
+    if parent is None and session is None:
+        return fn
+
+    def wrapped(*args, **kwargs):
+        previous_span, previous_session = current_span(), getattr(_local, 'profile_session', None)
+        _local.span, _local.profile_session = parent, session
+        try:
+            if session is None:
+                return fn(*args, **kwargs)
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(fn, *args, **kwargs)
+            finally:
+                session.add(profile)
+        finally:
+            _local.span, _local.profile_session = previous_span, previous_session
+    return wrapped
+
+
+def get_trace(trace_id):
+    for t in TRACES:
+        if t.id == trace_id:
+            return t
+    return None
+
+
+class ProfileSession:
+    """ Profiles of all the threads that work on one profiled call """
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles.append(profile)
+
+
+def profiled(name, fn, *args, **kwargs):
+    """
+    Runs fn under cProfile and dumps stats (merged with stats of wrapped functions) to PROFILE_DIR.
+    Threads that are still running when fn returns are not included.
+    :param name:    (str)   : prefix of the stats file
+    :return:        (tuple) : result of fn, path of the stats file
+    """
+    session = ProfileSession()
+    _local.profile_session = session
+    profile = cProfile.Profile()
+    try:
+        result = profile.runcall(fn, *args, **kwargs)
+    finally:
+        _local.profile_session = None
+        stats = pstats.Stats(profile)
+        with session.lock:
+            for thread_profile in session.profiles:
+                stats.add(thread_profile)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.prof')
+        stats.dump_stats(path)
+        logging.info(f'[PROFILE] stats of {len(session.profiles) + 1} thread(s) saved to {path}, '
+                     f'total time {stats.total_tt:.3f}s')
+    return result, path
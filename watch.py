@@ -0,0 +1,221 @@
+"""
+Watch mode of saved baskets - baskets are refreshed several times a day and baskets whose best total price
+has moved are reported. Refresh scraps search and offers pages again (prices change), but delivery costs
+of offers seen by earlier refreshes are reused. The algorithm is run only for baskets whose input offers
+have changed since the last refresh.
+
+Usage:
+python watch.py baskets.jsonl -o moves.jsonl --interval 14400 --threshold 0.05
+"""
+from main3 import *
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import random
+import sys
+
+
+class WatchedBasket:
+    """ Saved basket and the result of its last refresh """
+
+    def __init__(self, basket_id, user_reqs, next_run):
+        self.id = basket_id
+        self.user_reqs = user_reqs
+        self.next_run = next_run    # time of the next refresh
+        self.fingerprint = None     # fingerprint of input offers of the last optimization
+        self.best_price = None      # best total price of the last optimization, None if nothing was found
+        self.results = []           # result sets of the last optimization
+        self.runs = 0
+        self.skipped = 0            # refreshes without changed offers, the algorithm was not run
+
+
+class BasketWatcher:
+    """
+    Refreshes saved baskets on schedule. First refreshes are spread evenly over the interval and every
+    next refresh is moved randomly by up to jitter * interval, so baskets do not hit the site in bursts.
+    Products shared by baskets that are refreshed at the same time are scrapped once.
+    """
+
+    def __init__(self, baskets, interval=WATCH_INTERVAL, jitter=WATCH_JITTER, threshold=WATCH_THRESHOLD,
+                 workers=SEARCH_WORKERS, max_time=BATCH_QUERY_MAX_TIME, spread=True, seed=None):
+        """
+        :param baskets:     (list)      : list of tuples (basket id, list of UserRequirements), see parse_baskets
+        :param interval:    (float)     : seconds between refreshes of one basket
+        :param jitter:      (float)     : fraction of the interval, random shift of refresh time
+        :param threshold:   (float)     : relative move of the best total price that is reported
+        :param workers:     (int)       : number of products scrapped at the same time
+        :param max_time:    (float)     : deadline of scraping one product in seconds
+        :param spread:      (boolean)   : if False all baskets are refreshed at the first run_due
+        """
+        self.interval = interval
+        self.jitter = jitter
+        self.threshold = threshold
+        self.workers = workers
+        self.max_time = max_time
+        self.rng = random.Random(seed)
+        self.deliveries = {}        # map {normalized delivery url: (time of scraping, list of delivery prices)}
+        self.refreshed = 0          # number of scrapped products
+        now = time.time()
+        self.baskets = [WatchedBasket(basket_id, user_reqs, now + (k * interval / len(baskets) if spread else 0))
+                        for k, (basket_id, user_reqs) in enumerate(baskets)]
+
+    def next_time(self):
+        """ Time of the earliest refresh """
+        return min((basket.next_run for basket in self.baskets), default=None)
+
+    def run_due(self, now=None):
+        """
+        Refreshes baskets whose time has come.
+        :return:    (list)  : moves of best total prices, dicts {'id', 'old_price', 'new_price', 'change', 'results'}
+        """
+        now = time.time() if now is None else now
+        due = [basket for basket in self.baskets if basket.next_run <= now]
+        if not due:
+            return []
+
+        plists = self.refresh({normalize_query(user_req.name) for basket in due for user_req in basket.user_reqs})
+        moves = []
+        for basket in due:
+            move = self.optimize(basket, plists)
+            if move:
+                moves.append(move)
+            basket.next_run = now + self.interval * (1 + self.rng.uniform(-self.jitter, self.jitter))
+        logging.info(f'[WATCH] {len(due)} basket(s) refreshed, {len(moves)} moved, {len(plists)} product(s) scrapped')
+        return moves
+
+    def run_forever(self, stop=None):
+        """
+        Refreshes baskets on schedule until stop is set, yields moves as soon as they are found.
+        :param stop:    (threading.Event)   :
+        """
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            yield from self.run_due()
+            next_time = self.next_time()
+            stop.wait(self.interval if next_time is None else max(0, next_time - time.time()))   # None - no baskets
+
+    def refresh(self, queries):
+        """
+        Scraps products again. Search and offers pages are not taken from caches, delivery costs of offers
+        scrapped not earlier than WATCH_DELIVERY_MAX_AGE ago are put back to the delivery cache, so delivery
+        pages of known offers are not requested.
+        :param queries: (set)   : normalized queries
+        :return:        (dict)  : map {normalized query: ProductList}
+        """
+        now = time.time()
+        self.deliveries = {key: entry for key, entry in self.deliveries.items()
+                           if entry[0] >= now - WATCH_DELIVERY_MAX_AGE}
+        for key, (_, prices) in self.deliveries.items():
+            DELIVERY_CACHE.restore(key, now + DELIVERY_CACHE_TTL, list(prices))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            plists = dict(zip(queries, executor.map(self.load_query, queries)))
+
+        for key, _, prices in DELIVERY_CACHE.snapshot():
+            if key not in self.deliveries:
+                self.deliveries[key] = (now, prices)
+        self.refreshed += len(plists)
+        return plists
+
+    def load_query(self, query):
+        SEARCH_CACHE.invalidate(query)
+        ctx = SearchContext(self.max_time, find_time=0, tenant='watch', weight=BACKGROUND_WEIGHT)
+        plist = ProductList(query, DEFAULT_COUNT, SkapiecScraper(), MAX_OFFERS, MAX_STORES, ctx)
+        try:
+            plist.load_products()
+        except ProductNotFoundException:
+            logging.info(f'[WATCH] Product "{query}" not found')
+        return plist
+
+    @staticmethod
+    def fingerprint(user_reqs, plists):
+        """
+        Fingerprint of input of the algorithm: requirements of the basket and offers of its products.
+        """
+        items = []
+        for user_req in user_reqs:
+            plist = plists[normalize_query(user_req.name)]
+            offers = sorted((p.link, p.price, tuple(p.delivery_costs), p.rating, p.rating_count)
+                            for p in plist.products_list)
+            items.append((user_req.count, user_req.min_price, user_req.max_price, user_req.min_rating,
+                          user_req.nrates, plist.not_found, tuple(offers)))
+        return hash(tuple(items))
+
+    def optimize(self, basket, plists):
+        """
+        Runs the algorithm for the basket if its offers have changed.
+        :return:    (dict)  : move of the best total price, None if it has not moved beyond the threshold
+        """
+        basket.runs += 1
+        if any(not (plists[normalize_query(r.name)].complete or plists[normalize_query(r.name)].not_found)
+               for r in basket.user_reqs):
+            logging.warning(f'[WATCH] basket {basket.id}: offers have not been loaded, last result is kept')
+            return None
+        fingerprint = self.fingerprint(basket.user_reqs, plists)
+        if fingerprint == basket.fingerprint:
+            basket.skipped += 1
+            return None
+
+        for user_req in basket.user_reqs:
+            user_req.found_products = plists[normalize_query(user_req.name)].copy_for(user_req)
+        results = AlgorithmHandler(basket.user_reqs).find()
+        for user_req in basket.user_reqs:
+            user_req.found_products = []        # offers are not kept between refreshes
+
+        old_price, first = basket.best_price, basket.fingerprint is None
+        basket.fingerprint = fingerprint
+        basket.results = [result_set.to_dict() for result_set in results]
+        basket.best_price = basket.results[0]['total_price'] if basket.results else None
+        if first or not self.moved(old_price, basket.best_price):
+            return None
+        change = None if None in (old_price, basket.best_price) else round(basket.best_price - old_price, 2)
+        return {'id': basket.id, 'old_price': old_price, 'new_price': basket.best_price, 'change': change,
+                'results': basket.results}
+
+    def moved(self, old_price, new_price):
+        if old_price is None or new_price is None:
+            return old_price != new_price
+        return abs(new_price - old_price) > self.threshold * old_price
+
+    def stats(self):
+        return {'baskets': len(self.baskets), 'runs': sum(b.runs for b in self.baskets),
+                'skipped': sum(b.skipped for b in self.baskets), 'scrapped': self.refreshed,
+                'known_deliveries': len(self.deliveries)}
+
+
+def main(argv=None):
+    from batch_cli import read_baskets      # imported here, batch_cli imports the whole batch module
+    parser = argparse.ArgumentParser(description='Watch prices of saved baskets.')
+    parser.add_argument('input', help='JSONL file with baskets, see batch_cli.py')
+    parser.add_argument('-o', '--output', default='-', help='JSONL file with moves of best prices, "-" means stdout')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help='seconds between refreshes')
+    parser.add_argument('--jitter', type=float, default=WATCH_JITTER)
+    parser.add_argument('--threshold', type=float, default=WATCH_THRESHOLD, help='reported relative move')
+    parser.add_argument('-w', '--workers', type=int, default=SEARCH_WORKERS)
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.input, encoding='utf-8') as f:
+            baskets = read_baskets(f)
+    except InvalidBasketException as e:
+        logging.error(f'[WATCH] {e}')
+        return 2
+
+    watcher = BasketWatcher(baskets, args.interval, args.jitter, args.threshold, args.workers)
+    out = sys.stdout if args.output == '-' else open(args.output, 'a', encoding='utf-8')
+    try:
+        for move in watcher.run_forever():
+            out.write(json.dumps(move, ensure_ascii=False) + '\n')
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logging.info(f'[WATCH] {watcher.stats()}')
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,361 @@
+"""
+Scraping spread over many processes, on one machine or on many hosts. Coordinator serves a work queue
+(multiprocessing.managers), every page to fetch and parse is one task: search page, offers page or delivery
+pages of one offer. Worker processes take tasks from the queue and answer with compact records (products
+overview, StoreRows, delivery prices), the coordinator assembles them into ProductLists for AlgorithmHandler.
+Parsing holds the GIL, so throughput grows with the number of worker processes, not with threads.
+
+Usage:
+python batch_cli.py baskets.jsonl -o results.jsonl --queue 0.0.0.0:50505     # coordinator
+python workers.py worker --address coordinator-host:50505 --threads 8       # on every worker host
+python workers.py bench --processes 1 2 4                                   # local scaling test on fake site
+
+The queue exchanges pickles, so anyone who knows the key can run code on the coordinator and the workers.
+Key (SKAPIEC_WORKER_AUTHKEY) is required unless the queue is served on a loopback address, a random one
+is generated then.
+"""
+from main3 import *
+from concurrent.futures import Future, TimeoutError, wait, FIRST_COMPLETED
+from multiprocessing.managers import BaseManager
+from relevance import rank_overviews
+import argparse
+import ipaddress
+import itertools
+import multiprocessing
+import queue
+import secrets
+import sys
+
+STOP = None     # task that stops workers
+
+
+def parse_address(address, default_host='127.0.0.1'):
+    """
+    :param address: (str)   : "host:port" or "port"
+    :return:        (tuple) : (host, port)
+    """
+    host, _, port = address.rpartition(':')
+    return host or default_host, int(port)
+
+
+def is_loopback(host):
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def check_authkey(address, authkey):
+    """
+    :param address: (tuple) : (host, port) of the work queue
+    :param authkey: (str)   : shared secret, None if it is not set
+    :return:        (str)   : the key, random one if it is not set and the queue is on a loopback address
+    """
+    if authkey:
+        return authkey
+    if not is_loopback(address[0]):
+        raise WorkerAuthKeyException(f'work queue on {address[0]}:{address[1]} needs SKAPIEC_WORKER_AUTHKEY')
+    return secrets.token_hex(16)
+
+
+def search_task(arg, ctx):
+    query, refresh = arg
+    if refresh:
+        SEARCH_CACHE.invalidate(normalize_query(query))     # search cache of the worker
+    scraper = SkapiecScraper()
+    found = scraper.load_page(query, ctx)
+    return {'found': found, 'not_found': scraper.not_found, 'overviews': scraper.get_products_overview()}
+
+
+def offers_task(url, ctx):
+    return [tuple(row) if row else None for row in DetailedSite(url, 0, ctx).stores]
+
+
+def delivery_task(delivery_url, ctx):
+    return scrap_delivery_prices(delivery_url, ctx)
+
+
+TASKS = {'search': search_task, 'offers': offers_task, 'delivery': delivery_task}
+
+
+class ScrapeCoordinator:
+    """
+    Sends scraping tasks to workers and assembles their answers. It can be used as the loader of
+    SkapiecOptimizer, see load_product_list. Tasks lost by a dead worker end with the deadline of the search
+    and their futures are dropped.
+    """
+
+    def __init__(self, address=('127.0.0.1', WORKER_QUEUE_PORT), authkey=WORKER_AUTHKEY):
+        """
+        :param address: (tuple) : (host, port) the work queue is served on, port 0 means any free port
+        :param authkey: (str)   : shared secret of coordinator and workers, required on non-loopback address
+        """
+        self.authkey = check_authkey(address, authkey)
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.futures = {}           # map {task id: Future}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.sent = {kind: 0 for kind in TASKS}
+
+        manager_class = type('CoordinatorManager', (BaseManager,), {})     # registry of this coordinator only
+        manager_class.register('tasks', callable=lambda: self.tasks)
+        manager_class.register('results', callable=lambda: self.results)
+        self.server = manager_class(address=address, authkey=self.authkey.encode()).get_server()
+        self.address = self.server.address
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.dispatch, daemon=True).start()
+        logging.info(f'[COORDINATOR] work queue served on {self.address[0]}:{self.address[1]}')
+        if not authkey:
+            logging.info(f'[COORDINATOR] SKAPIEC_WORKER_AUTHKEY is not set, workers have to use key {self.authkey}')
+
+    def submit(self, kind, arg, ctx=None):
+        """
+        :param kind:    (str)           : one of TASKS
+        :param arg:                     : (query, refresh) of search task, url of the page of other tasks
+        :param ctx:     (SearchContext) : deadline of the search is passed to the worker
+        :return:        (Future)        : answer of the worker, exception if the task has failed
+        """
+        future = Future()
+        with self.lock:
+            task_id = next(self.ids)
+            future.task_id = task_id
+            self.futures[task_id] = future
+            self.sent[kind] += 1
+        self.tasks.put((task_id, kind, arg, ctx.remaining() if ctx else None))
+        return future
+
+    def dispatch(self):
+        while True:
+            task_id, ok, value = self.results.get()
+            with self.lock:
+                future = self.futures.pop(task_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(ScrapingTaskException(value))
+
+    def forget(self, futures):
+        """
+        Drops futures of tasks the coordinator does not wait for any more (deadline passed, worker died),
+        late answers of their tasks are ignored.
+        """
+        with self.lock:
+            for future in futures:
+                self.futures.pop(future.task_id, None)
+        for future in futures:
+            future.cancel()
+
+    def close(self):
+        self.tasks.put(STOP)        # every worker puts it back, so it stops all of them
+
+    def load_product_list(self, name, max_offers, max_stores, ctx, refresh=False):
+        """
+        Scraps offers of one product with workers, drop-in replacement of SkapiecOptimizer.load_product_list.
+        Offers pages are requested as soon as search page is parsed and delivery pages as soon as offers page is.
+        :param refresh: (boolean)   : if True offers are not read from the offer store
+        :return:        (ProductList)   :
+        """
+        plist = ProductList(name, DEFAULT_COUNT, None, max_offers, max_stores, ctx, OFFER_STORE)
+        if not refresh and plist.load_stored_products():
+            logging.info(f'[COORDINATOR] offers of "{name}" loaded from offer store')
+            plist.products_list.sort(key=lambda x: (x.total_min_price, -x.rating))
+            return plist
+
+        search = self.result(self.submit('search', (name, refresh), ctx), ctx)
+        if search is None:
+            return plist
+        if not search['found']:
+            if not search['not_found']:
+                if ctx:
+                    ctx.mark_partial(f'search page of "{name}" has not been loaded')
+                return plist
+            plist.not_found = True
+            logging.info('[SEARCH] Product "{}" not found'.format(name))
+            return plist
+
+        overviews = search['overviews']
+        indexes = rank_overviews(name, overviews) if RELEVANCE_ENABLED else list(range(len(overviews)))
+        pages = {self.submit('offers', overviews[k]['link'], ctx): k for k in indexes[:max_offers]}
+        deliveries = {}         # map {Future: (overview index, StoreRow)}
+        failed = False
+        pending = set(pages)
+        pid = next_product_id()
+        while pending and not (ctx and ctx.expired()):
+            done, pending = wait(pending, timeout=ctx.remaining() if ctx else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in pages:
+                    failed = self.add_rows(future, pages[future], max_stores, deliveries, pending, ctx) or failed
+                    continue
+                k, row = deliveries[future]
+                try:
+                    prices = future.result()
+                except ScrapingTaskException as e:
+                    logging.error(f'[COORDINATOR] delivery task failed: {e}')
+                    failed = True
+                    continue
+                if prices:
+                    p = Product(pid, row.name, row.price, prices, row.rating_avg, row.rating_count,
+                                URL + row.href, row.store_name)
+                    p.count = DEFAULT_COUNT
+                    p.overview_idx = k
+                    plist.products_list.append(p)
+
+        if pending:
+            self.forget([future for future in pending if hasattr(future, 'task_id')])
+            ctx.mark_partial(f'offers of "{name}" have not been loaded')
+        plist.complete = not pending and not failed
+        if plist.complete and OFFER_STORE:
+            try:
+                OFFER_STORE.save(name, overviews, plist.products_list, max_offers, max_stores)
+            except sqlite3.Error as e:
+                logging.error(f'[COORDINATOR] error while writing offer store: {e}')
+        plist.products_list.sort(key=lambda x: (x.total_min_price, -x.rating))
+        return plist
+
+    def add_rows(self, future, k, max_stores, deliveries, pending, ctx):
+        """
+        Submits delivery tasks of store rows of one offers page, offers with free delivery are resolved at once.
+        :return:    (boolean)   : True if the offers task has failed
+        """
+        try:
+            rows = future.result()
+        except ScrapingTaskException as e:
+            logging.error(f'[COORDINATOR] offers task failed: {e}')
+            return True
+        for row in rows[:max_stores]:
+            if row is None:
+                continue
+            row = StoreRow(*row)
+            if row.free_delivery:
+                delivery = Future()
+                delivery.set_result([0.00])
+            else:
+                delivery = self.submit('delivery', row.delivery_url, ctx)
+            deliveries[delivery] = (k, row)
+            pending.add(delivery)
+        return False
+
+    def result(self, future, ctx):
+        try:
+            return future.result(timeout=ctx.remaining() if ctx else None)
+        except ScrapingTaskException as e:
+            logging.error(f'[COORDINATOR] search task failed: {e}')
+        except TimeoutError:
+            self.forget([future])
+            ctx.mark_partial('search page has not been loaded')
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {'sent': dict(self.sent), 'waiting': len(self.futures)}
+
+
+def run_worker(address, authkey=WORKER_AUTHKEY, threads=WORKER_THREADS):
+    """
+    Takes tasks from the work queue of the coordinator until STOP task is received.
+    :param address: (tuple) : (host, port) of the coordinator
+    :param authkey: (str)   : shared secret of coordinator and workers
+    """
+    if not authkey:
+        raise WorkerAuthKeyException('worker needs SKAPIEC_WORKER_AUTHKEY of the coordinator')
+    manager_class = type('WorkerManager', (BaseManager,), {})
+    manager_class.register('tasks')
+    manager_class.register('results')
+    manager = manager_class(address=address, authkey=authkey.encode())
+    manager.connect()
+    tasks, results = manager.tasks(), manager.results()
+    logging.info(f'[WORKER] connected to {address[0]}:{address[1]}, {threads} thread(s)')
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is STOP:
+                tasks.put(STOP)
+                return
+            task_id, kind, arg, timeout = task
+            ctx = SearchContext(timeout, find_time=0) if timeout is not None else None
+            try:
+                results.put((task_id, True, TASKS[kind](arg, ctx)))
+            except Exception as e:
+                results.put((task_id, False, f'{kind} {arg}: {e!r}'))
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(threads)]
+    [w.start() for w in workers]
+    [w.join() for w in workers]
+
+
+def bench(processes, queries, threads, padding):
+    """
+    Scraps the same queries with coordinator and growing number of local worker processes, the fake site
+    (see fake_skapiec.py) runs in its own process, so it does not take the GIL of the coordinator.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    ready = multiprocessing.Queue()
+    site = multiprocessing.Process(target=serve_fake_site, args=(padding, ready), daemon=True)
+    site.start()
+    site_url = ready.get()
+
+    for count in processes:
+        coordinator = ScrapeCoordinator(('127.0.0.1', 0))
+        workers = [multiprocessing.Process(target=bench_worker,
+                                           args=(site_url, coordinator.address, coordinator.authkey, threads),
+                                           daemon=True) for _ in range(count)]
+        [w.start() for w in workers]
+        start = time.time()
+        executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS)
+        plists = list(executor.map(lambda q: coordinator.load_product_list(q, MAX_OFFERS, MAX_STORES, None),
+                                   [f'bench {count} {k}' for k in range(queries)]))
+        duration = time.time() - start
+        coordinator.close()
+        [w.join(5) for w in workers]
+        print(f'{count:>3} process(es): {duration:6.2f}s, {sum(coordinator.sent.values()) / duration:7.1f} tasks/s, '
+              f'{sum(len(p.products_list) for p in plists)} offers')
+    site.terminate()
+
+
+def serve_fake_site(padding, ready):
+    import fake_skapiec
+    server = fake_skapiec.serve(fake_skapiec.SiteConfig(results=8, offers=10, stores=40, padding=padding))
+    ready.put(f'http://127.0.0.1:{server.server_port}')
+    while True:
+        time.sleep(60)
+
+
+def bench_worker(site_url, address, authkey, threads):
+    import scraper2
+    scraper2.URL = site_url
+    run_worker(address, authkey, threads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Distributed scraping workers.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    worker = commands.add_parser('worker', help='process tasks of the coordinator')
+    worker.add_argument('--address', default=f'127.0.0.1:{WORKER_QUEUE_PORT}', help='host:port of the coordinator')
+    worker.add_argument('--threads', type=int, default=WORKER_THREADS)
+    benchmark = commands.add_parser('bench', help='local scaling test on the fake site')
+    benchmark.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    benchmark.add_argument('--queries', type=int, default=40)
+    benchmark.add_argument('--threads', type=int, default=WORKER_THREADS)
+    benchmark.add_argument('--padding', type=int, default=100000, help='bytes of filler markup of every page')
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        try:
+            run_worker(parse_address(args.address), threads=args.threads)
+        except WorkerAuthKeyException as e:
+            logging.error(f'[WORKER] {e}')
+            return 2
+    else:
+        bench(args.processes, args.queries, args.threads, args.padding)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    sys.exit(main())